@@ -11,8 +11,14 @@ Outputs:
 
 # --- Import modules ---
 import datetime
+import io
 import logging
+import mmap
+import os
+import struct
 import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from pathlib import Path
 from obspy import read, UTCDateTime
 
@@ -61,6 +67,19 @@ starttimes = [
     UTCDateTime("2019-01-12T01:00:00.000000Z"),
 ]
 
+# Skip flag (skip chunks whose aligned file is newer than the raw file if True)
+# Raw files are matched to chunk start times by the timestamps in their names
+skip_aligned = True
+
+# Parallel worker processes for alignment (1 aligns files one at a time)
+workers = 4
+
+# Header-only alignment flag (shift record header start times without decoding
+# samples if True)
+# Falls back to decoding files whose records cannot be patched in place
+header_only = True
+block_size = 64 * 1024**2  # Bytes of records held in memory at once (64 MB)
+
 # Verbose logging flag (includes time shift and stream information if True)
 verbose_logging = False
 
@@ -68,6 +87,339 @@ verbose_logging = False
 #                            End of Configurations                             #
 # ##############################################################################
 
+
+def chunk_times(strm_path):
+    """Parse the start and end times get.py writes into a chunk file name.
+
+    Returns None if the name does not end in start and end timestamps.
+    """
+    parts = strm_path.stem.split("_")
+    if len(parts) < 3:
+        return None
+    try:
+        return tuple(
+            UTCDateTime(datetime.datetime.strptime(part, "%Y%m%d%H%M%S%f"))
+            for part in parts[-2:]
+        )
+    except ValueError:
+        return None
+
+
+def is_aligned(strm_path):
+    """Check for an aligned file written after its raw mSEED file."""
+    aligned_file_path = a_mseed_path / f"aligned_{strm_path.name}"
+    return (
+        aligned_file_path.exists()
+        and aligned_file_path.stat().st_mtime >= strm_path.stat().st_mtime
+    )
+
+
+def stream_shifts(strm, t_start):
+    """Compute the time shift aligning each trace to the chunk start time."""
+    shifts = []  # Time shift records
+    for tr in strm:
+        shift = t_start - tr.stats.starttime  # Time shift
+        if shift >= (1 / fs):
+            raise ValueError(f"Time shift for trace {tr.id} exceeds sampling period")
+        shifts.append(shift)  # Record time shift
+    return shifts
+
+
+def record_layout(raw):
+    """Parse the byte order, record length, and blockette offsets of a mSEED 2 record.
+
+    Returns None if the first record is not a patchable mSEED 2 record.
+    """
+    header = raw[:48].tobytes()
+    if len(header) < 48 or header[6:7] not in (b"D", b"R", b"Q", b"M"):
+        return None
+
+    # Byte order from a plausible start year and day of year
+    for bo in (">", "<"):
+        year, doy = struct.unpack_from(f"{bo}HH", header, 20)
+        if 1900 <= year <= 2100 and 1 <= doy <= 366:
+            break
+    else:
+        return None
+
+    # Blockette 1000 holds the record length, blockette 1001 the microseconds
+    (next_blockette,) = struct.unpack_from(f"{bo}H", header, 46)
+    blockettes = {}
+    while next_blockette:
+        blockette = raw[next_blockette : next_blockette + 8].tobytes()
+        if len(blockette) < 8 or next_blockette in blockettes.values():
+            return None
+        b_type, b_next = struct.unpack_from(f"{bo}HH", blockette)
+        blockettes[b_type] = next_blockette
+        if b_type == 1000:
+            reclen = 2 ** blockette[6]
+        next_blockette = b_next
+    if 1000 not in blockettes:
+        return None
+    return bo, reclen, blockettes
+
+
+def header_field(recs, offset, dtype):
+    """View a header field of every record as an array."""
+    size = np.dtype(dtype).itemsize
+    return np.ascontiguousarray(recs[:, offset : offset + size]).view(dtype).ravel()
+
+
+def set_header_field(recs, offset, dtype, values):
+    """Write a header field of every record from an array."""
+    size = np.dtype(dtype).itemsize
+    field = np.asarray(values).astype(dtype).view(np.uint8)
+    recs[:, offset : offset + size] = field.reshape(-1, size)
+
+
+def patch_block(recs, layout, first, spans):
+    """Shift the start times of a block of records in place.
+
+    Returns False if a record does not share the first record's layout, or
+    cannot be matched to a trace or given its shifted time.
+    """
+    bo, reclen, blockettes = layout
+
+    # Check every record shares the first record's layout
+    same = np.isin(recs[:, 6], list(b"DRQM")) & (recs[:, 39] == first[39])
+    for offset in [44, *blockettes.values()]:
+        same &= (recs[:, offset : offset + 4] == first[offset : offset + 4]).all(1)
+    same &= recs[:, blockettes[1000] + 6] == first[blockettes[1000] + 6]
+    if not same.all():
+        return False
+    b1001 = blockettes.get(1001)
+
+    # Record start times (in nanoseconds), with any unapplied time correction
+    year = header_field(recs, 20, f"{bo}u2").astype(np.int64)
+    doy = header_field(recs, 22, f"{bo}u2").astype(np.int64)
+    hour, minute, second = (recs[:, i].astype(np.int64) for i in (24, 25, 26))
+    fract = header_field(recs, 28, f"{bo}u2").astype(np.int64)
+    usec = recs[:, b1001 + 5].view(np.int8).astype(np.int64) if b1001 else 0
+    days = (year - 1970).astype("datetime64[Y]").astype("datetime64[D]")
+    days = days.astype(np.int64) + doy - 1
+    seconds = days * 86400 + hour * 3600 + minute * 60 + second
+    btime = (seconds * 1_000_000 + fract * 100 + usec) * 1000
+    correction = header_field(recs, 40, f"{bo}i4").astype(np.int64) * 100_000
+    start = np.where(recs[:, 36] & 0x02, btime, btime + correction)
+
+    # Match records to traces by id and time span, allowing half a sample
+    half_sample = int(0.5e9 / fs)
+    codes = np.ascontiguousarray(recs[:, 8:20]).view("S12").ravel()
+    shift = np.zeros(len(recs), dtype=np.int64)
+    for code in np.unique(codes):
+        text = code.decode("ascii", "replace").ljust(12)
+        sta, loc, cha, net = text[:5], text[5:7], text[7:10], text[10:12]
+        rec_id = ".".join(c.strip() for c in (net, sta, loc, cha))
+        if rec_id not in spans:
+            return False
+        t1, t2, trace_shifts = spans[rec_id]
+        mask = codes == code
+        idx = np.searchsorted(t1 - half_sample, start[mask], side="right") - 1
+        if (idx < 0).any() or (start[mask] > t2[idx] + half_sample).any():
+            return False
+        shift[mask] = trace_shifts[idx]
+
+    # Shifted record start times (in microseconds) back into the headers
+    usecs = (btime + shift + 500) // 1000
+    if b1001 is None and (usecs % 100).any():
+        return False  # Sub-100 microsecond times without blockette 1001
+    seconds, fract = np.divmod(usecs, 1_000_000)
+    days, seconds = np.divmod(seconds, 86400)
+    dates = days.astype("datetime64[D]")
+    years = dates.astype("datetime64[Y]")
+    set_header_field(recs, 20, f"{bo}u2", years.astype(np.int64) + 1970)
+    set_header_field(recs, 22, f"{bo}u2", (dates - years).astype(np.int64) + 1)
+    recs[:, 24] = seconds // 3600
+    recs[:, 25] = seconds // 60 % 60
+    recs[:, 26] = seconds % 60
+    recs[:, 27] = 0
+    set_header_field(recs, 28, f"{bo}u2", fract // 100)
+    if b1001:
+        recs[:, b1001 + 5] = (usecs % 100).astype(np.int8).view(np.uint8)
+    return True
+
+
+def patch_record_times(src, dst, strm, shifts):
+    """Copy a mSEED file, shifting record start times without decoding samples.
+
+    Records are patched in blocks of up to block_size bytes, so they must share
+    one record length and blockette layout. Returns False, leaving no output
+    file, otherwise.
+    """
+    if src.stat().st_size == 0:
+        return False
+    raw = np.memmap(src, dtype=np.uint8, mode="r")  # Paged in block by block
+    layout = record_layout(raw)
+    if layout is None:
+        return False
+    bo, reclen, blockettes = layout
+    if raw.size % reclen:
+        return False
+    recs = raw.reshape(-1, reclen)
+    first = np.array(recs[0])
+
+    # Trace time spans and shifts (in nanoseconds) by trace id
+    spans = {}
+    for tr, shift in zip(strm, shifts):
+        spans.setdefault(tr.id, []).append(
+            (tr.stats.starttime.ns, tr.stats.endtime.ns, int(round(shift * 1e9)))
+        )
+    spans = {
+        rec_id: tuple(np.array(col, dtype=np.int64) for col in zip(*sorted(rows)))
+        for rec_id, rows in spans.items()
+    }
+
+    part = dst.with_name(f"{dst.name}.part")
+    block_records = max(block_size // reclen, 1)
+    with open(part, "wb") as out:
+        for i in range(0, len(recs), block_records):
+            block = np.array(recs[i : i + block_records])  # Copy into memory
+            if not patch_block(block, layout, first, spans):
+                break
+            block.tofile(out)
+        else:
+            part.replace(dst)
+            return True
+    part.unlink()
+    return False
+
+
+def record_index(path):
+    """Map each trace id to the byte ranges of its records, reading headers only.
+
+    Returns None if a record is not a complete mSEED 2 record with blockette 1000.
+    """
+    index = {}  # Record byte ranges by trace id, in file order
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return index
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            offset = 0
+            while offset < size:
+                if offset + 48 > size or buf[offset + 6] not in b"DRQM":
+                    return None  # Truncated or not a data record
+
+                # Byte order from a plausible start year
+                (year,) = struct.unpack_from(">H", buf, offset + 20)
+                bo = ">" if 1900 <= year <= 2100 else "<"
+
+                # Record length from blockette 1000
+                reclen = None
+                visited = set()  # Blockette offsets, to stop on looping chains
+                (next_blockette,) = struct.unpack_from(f"{bo}H", buf, offset + 46)
+                while next_blockette and reclen is None:
+                    if next_blockette < 48 or next_blockette in visited:
+                        return None
+                    if offset + next_blockette + 8 > size:
+                        return None  # Blockette beyond the end of the file
+                    visited.add(next_blockette)
+                    b_type, b_next = struct.unpack_from(
+                        f"{bo}HH", buf, offset + next_blockette
+                    )
+                    if b_type == 1000:
+                        reclen = 2 ** min(buf[offset + next_blockette + 6], 31)
+                    next_blockette = b_next
+                if reclen is None or reclen < 128 or offset + reclen > size:
+                    return None  # No record length, or a truncated record
+
+                code = buf[offset + 8 : offset + 20].decode("ascii", "replace")
+                sta, loc, cha, net = code[:5], code[5:7], code[7:10], code[10:12]
+                trace_id = ".".join(c.strip() for c in (net, sta, loc, cha))
+                ranges = index.setdefault(trace_id, [])
+                if ranges and ranges[-1][1] == offset:
+                    ranges[-1][1] = offset + reclen  # Extend a contiguous range
+                else:
+                    ranges.append([offset, offset + reclen])
+                offset += reclen
+    return index
+
+
+def read_channel(path, index, trace_id):
+    """Read one trace id's records from a mSEED file."""
+    if index is None:
+        return read(path, sourcename=trace_id)  # Filtered scan of the whole file
+    with open(path, "rb") as f:
+        data = bytearray()
+        for start, end in index[trace_id]:
+            f.seek(start)
+            data += f.read(end - start)
+    return read(io.BytesIO(data), format="MSEED")
+
+
+def decode_and_align(strm_path, dst, t_start):
+    """Decode, shift, and write a mSEED file one trace id at a time.
+
+    Records are indexed in one pass, so each trace id reads only its own records.
+    """
+    part = dst.with_name(f"{dst.name}.part")
+    if seismic_format != "MSEED":
+        strm = read(strm_path)  # Formats other than mSEED are written whole
+        for tr, shift in zip(strm, stream_shifts(strm, t_start)):
+            tr.stats.starttime += shift  # Apply time shift to trace
+        strm.write(part, format=seismic_format)
+    else:
+        trace_ids = dict.fromkeys(tr.id for tr in read(strm_path, headonly=True))
+        index = record_index(strm_path)
+        with open(part, "wb") as out:
+            for trace_id in trace_ids:
+                strm = read_channel(strm_path, index, trace_id)
+                for tr, shift in zip(strm, stream_shifts(strm, t_start)):
+                    tr.stats.starttime += shift  # Apply time shift to trace
+                strm.write(out, format=seismic_format)
+    part.replace(dst)
+
+
+def align_file(strm_path, t_start):
+    """Align one raw mSEED file's traces and return its log messages."""
+    messages = []  # Log levels and messages, replayed by the main process
+    use_headers = header_only and seismic_format == "MSEED"
+    strm = read(strm_path, headonly=True)  # Trace headers only, no samples decoded
+    strm_file_path = Path(strm_path)
+    messages.append((logging.INFO, f"Aligning {strm_file_path.name} traces..."))
+
+    shifts = stream_shifts(strm, t_start)
+
+    # Ensure aligned mSEED directory exists
+    a_mseed_path.mkdir(parents=True, exist_ok=True)
+    aligned_file_path = a_mseed_path / f"aligned_{strm_file_path.name}"
+
+    # Write aligned file to aligned mSEED directory
+    patched = use_headers and patch_record_times(
+        strm_path, aligned_file_path, strm, shifts
+    )
+    if use_headers and not patched:
+        messages.append(
+            (
+                logging.WARNING,
+                f"Cannot patch {strm_file_path.name} record headers, decoding instead",
+            )
+        )
+    if not patched:
+        decode_and_align(strm_path, aligned_file_path, t_start)
+
+    for tr, shift in zip(strm, shifts):
+        tr.stats.starttime += shift  # Apply time shift to trace headers
+
+    if verbose_logging:
+        # Log header
+        messages.append(
+            (logging.INFO, "Trace Index | Time Shift [s] | Trace Information")
+        )
+        messages.append(
+            (logging.INFO, "-----------------------------------------------------")
+        )
+
+        # Iterate through each trace and its corresponding time shift
+        for i, (trc, ts) in enumerate(zip(strm, shifts)):
+            # Format each line with aligned columns
+            messages.append((logging.INFO, f"{i:<11} | {ts:<14.6f} | {trc}"))
+        messages.append(
+            (logging.INFO, "################################################\n")
+        )
+    return messages
+
+
 if __name__ == "__main__":
     # --- Ensure log directory exists ---
     log_path.mkdir(parents=True, exist_ok=True)
@@ -102,15 +454,37 @@ if __name__ == "__main__":
         logging.error(time_type_error)
         raise ValueError(time_type_error)
 
-    # --- Sort raw mSEED files chronologically ---
-    strms = sorted(r_mseed_path.glob(mseed_pattern))
-
-    # --- Check if number of mSEED files matches start times ---
-    if len(strms) != len(starttimes):
-        logging.error(
-            f"Mismatch: {len(strms)} mSEED files vs {len(starttimes)} start times"
-        )
-        raise ValueError("Mismatch in number of mSEED files and start times")
+    # --- Index raw mSEED files by the start times in their names ---
+    index = {}  # Raw mSEED files by start time (in nanoseconds)
+    for strm_path in sorted(r_mseed_path.glob(mseed_pattern)):
+        times = chunk_times(strm_path)
+        if times is None:
+            logging.warning(f"No chunk times in {strm_path.name}, ignoring")
+        elif times[0].ns in index:
+            logging.warning(
+                f"Duplicate chunk {strm_path.name} for {times[0]}, "
+                f"using {index[times[0].ns].name}"
+            )
+        else:
+            index[times[0].ns] = strm_path
+
+    # --- Match raw mSEED files to start times ---
+    strms, strm_starttimes = [], []
+    missing = aligned = 0
+    for t_start in starttimes:
+        strm_path = index.get(t_start.ns)
+        if strm_path is None:
+            logging.warning(f"No raw mSEED file for chunk starting {t_start}")
+            missing += 1
+        elif skip_aligned and is_aligned(strm_path):
+            aligned += 1
+        else:
+            strms.append(strm_path)
+            strm_starttimes.append(t_start)
+    logging.info(
+        f"{len(strms)} of {len(starttimes)} chunks to align "
+        f"({aligned} already aligned, {missing} missing)"
+    )
 
     logging.info("################################################")
     logging.info("Aligning stream trace times...")
@@ -120,39 +494,16 @@ if __name__ == "__main__":
     logging.info("################################################")
 
     # --- Align traces to original start times ---
-    for strm_path, t_start in zip(strms, starttimes):
-        strm = read(strm_path)  # Read stream
-        strm_file_path = Path(strm_path)
-        logging.info(f"Aligning {strm_file_path.name} traces...")
-
-        shifts = []  # Time shift records
-        for tr in strm:
-            shift = t_start - tr.stats.starttime  # Time shift
-            if shift >= (1 / fs):
-                logging.error(f"Time shift for trace {tr.id} exceeds sampling period")
-                raise ValueError(
-                    f"Time shift for trace {tr.id} exceeds sampling period"
-                )
-            tr.stats.starttime += shift  # Apply time shift to trace
-            shifts.append(shift)  # Record time shift
-
-        if verbose_logging:
-            # Log header
-            logging.info("Trace Index | Time Shift [s] | Trace Information")
-            logging.info("-----------------------------------------------------")
-
-            # Iterate through each trace and its corresponding time shift
-            for i, (trc, ts) in enumerate(zip(strm, shifts)):
-                # Format each line with aligned columns
-                logging.info(f"{i:<11} | {ts:<14.6f} | {trc}")
-            logging.info("################################################\n")
-
-        # Ensure aligned mSEED directory exists
-        a_mseed_path.mkdir(parents=True, exist_ok=True)
-
-        # Write stream to aligned mSEED directory
-        aligned_file_path = a_mseed_path / f"aligned_{strm_file_path.name}"
-        strm.write(aligned_file_path, format=seismic_format)
+    # Files are aligned in worker processes and their logs replayed in file order
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        try:
+            for messages in executor.map(align_file, strms, strm_starttimes):
+                for level, message in messages:
+                    logging.log(level, message)
+        except ValueError as e:
+            logging.error(e)
+            executor.shutdown(cancel_futures=True)  # Stop pending files
+            raise
 
     logging.info("################################################\n")
 
@@ -2,7 +2,7 @@
 Script to prepare mSEED files for QuakeMigrate input
 
 Inputs:
-    - Aligned (or raw if alignment not needed) mSEED files
+    - Aligned (or raw if alignment not needed or fused) mSEED files
 
 Outputs:
     - QuakeMigrate-formatted input mSEED files
@@ -10,11 +10,18 @@ Outputs:
 """
 
 # --- Import modules ---
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import datetime
+import io
+import json
 import logging
+import mmap
 import numpy as np
-from obspy import read
+from obspy import read, Stream, UTCDateTime
+import os
 from pathlib import Path
+from scipy import signal
+import struct
 import sys
 import warnings
 
@@ -24,16 +31,33 @@ import warnings
 
 # Input paths
 a_mseed_path = Path("./inputs/aligned_mSEED")  # Aligned mSEED directory
+r_mseed_path = Path("./inputs/raw_mSEED")  # Raw mSEED directory, if fusing alignment
 
 # Output paths
 log_path = Path("./inputs/logs")  # Log directory
 mseed_path = Path("./inputs/mSEED")  # QuakeMigrate inputs mSEED directory
+metadata_file = Path("./inputs/mSEED/format_metadata.json")  # Output metadata
+manifest_file = Path("./inputs/mSEED/format_manifest.json")  # Format manifest
 
 # Wildcard pattern to match aligned mSEED files
 # Sometimes, the wildcard may be too broad and match unwanted files
 # Alternatively, point a_mseed_path to a directory containing only target files
 mseed_pattern = "*.mseed"
 
+# Fused alignment flag (align raw mSEED traces while formatting if True)
+# Reads raw mSEED files from r_mseed_path and shifts their traces to the chunk
+# start times get.py writes into the file names, in place of running align.py
+# Set write_aligned to True to also keep the aligned mSEED intermediate files
+fuse_alignment = False
+write_aligned = False
+fs = 1000  # Trace sampling frequency (in Hz) of the input mSEED files
+
+# Target sampling frequency (in Hz) to resample traces to once, with zero-phase
+# anti-alias filtering, e.g. 500 to match STALTAOnset(sampling_rate=500)
+# Integer factors of the trace sampling frequency are decimated, others resampled
+# Set to None to keep the recorded sampling frequency
+target_fs = None
+
 # Seismogram channels
 channels = ["GPZ", "GP1", "GP2"]
 
@@ -43,6 +67,25 @@ channels = ["GPZ", "GP1", "GP2"]
 # Match archive_format in detect.py and locate.py
 archive_format = "YEAR/JD/*_STATION_*"
 
+# Output mSEED encoding:
+# "FLOAT64": Zero-centered float64 samples, uncompressed
+# "FLOAT32": Zero-centered float32 samples, uncompressed, half the size of FLOAT64
+# "STEIM2": Zero-centered integer counts, Steim2-compressed (integer input is
+# centered by a whole-count offset, keeping samples exact)
+output_encoding = "FLOAT64"
+record_length = 4096  # mSEED record length (in bytes), a power of 2 from 256
+
+# Parallel worker processes for formatting files (1 formats files one at a time)
+# and concurrent threads writing each file's output traces
+workers = 4
+write_workers = 4
+
+# Incremental flag (format only new or changed input files if True)
+# The manifest maps each input file (size and modification time) to its output
+# files; outputs of changed or removed inputs that are no longer produced are
+# deleted, and changing the encoding or sampling settings reformats every file
+incremental = True
+
 # Verbose logging flag (includes trace information if True)
 verbose_logging = False
 
@@ -50,6 +93,309 @@ verbose_logging = False
 #                            End of Configurations                             #
 # ##############################################################################
 
+
+def chunk_times(strm_path):
+    """Parse the start and end times get.py writes into a chunk file name.
+
+    Returns None if the name does not end in start and end timestamps.
+    """
+    parts = strm_path.stem.split("_")
+    if len(parts) < 3:
+        return None
+    try:
+        return tuple(
+            UTCDateTime(datetime.datetime.strptime(part, "%Y%m%d%H%M%S%f"))
+            for part in parts[-2:]
+        )
+    except ValueError:
+        return None
+
+
+def align_stream(strm, t_start):
+    """Shift each trace to the chunk start time, as in align.py."""
+    for tr in strm:
+        shift = t_start - tr.stats.starttime  # Time shift
+        if shift >= (1 / fs):
+            raise ValueError(f"Time shift for trace {tr.id} exceeds sampling period")
+        tr.stats.starttime += shift  # Apply time shift to trace
+
+
+def zero_center(data):
+    """Zero-center trace samples in the data type of the output encoding."""
+    if output_encoding == "STEIM2":
+        if np.issubdtype(data.dtype, np.integer):
+            # Integer offset keeps the counts exact, centered to within half a count
+            return (data - int(round(np.mean(data)))).astype(np.int32)
+        return np.rint(data - np.mean(data)).astype(np.int32)
+    if output_encoding == "FLOAT32":
+        return (data - np.mean(data)).astype(np.float32)
+    return data - np.mean(data)
+
+
+def resample_trace(trc):
+    """Resample a trace to target_fs with zero-phase anti-alias filtering."""
+    if trc.stats.sampling_rate == target_fs:
+        return
+    trc.data = trc.data - np.mean(trc.data)  # Avoid filter edge steps from offsets
+    factor = trc.stats.sampling_rate / target_fs
+    if factor.is_integer():
+        # Low-pass below the new Nyquist frequency, then keep every factor-th sample
+        sos = signal.butter(
+            8, 0.4 * target_fs, fs=trc.stats.sampling_rate, output="sos"
+        )
+        # Shorten the edge padding for fragments (e.g. around gaps) shorter than it
+        ntaps = 2 * len(sos) + 1
+        ntaps -= min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+        padlen = min(3 * ntaps, trc.stats.npts - 1)
+        # Forward-backward, zero-phase
+        trc.data = signal.sosfiltfilt(sos, trc.data, padlen=padlen)
+        trc.decimate(int(factor), no_filter=True)
+    else:
+        trc.resample(target_fs)  # Frequency-domain resampling, Hann window
+
+
+def load_manifest(manifest_file):
+    """Load the format manifest, or start an empty one."""
+    if not manifest_file.exists():
+        return {}
+    try:
+        with open(manifest_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Unreadable manifest {manifest_file.name}, starting over: {e}")
+        return {}
+
+
+def save_manifest(manifest, manifest_file):
+    """Write the format manifest atomically."""
+    tmp_file = manifest_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    tmp_file.replace(manifest_file)
+
+
+def input_signature(path):
+    """Identify an input file version by its size and modification time."""
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def remove_outputs(outputs):
+    """Delete output files and any directories they leave empty."""
+    for output in outputs:
+        path = Path(output)
+        path.unlink(missing_ok=True)
+        try:
+            path.parent.rmdir()
+        except OSError:
+            pass  # Directory still holds other outputs
+
+
+def write_traces(path, traces, mode="wb"):
+    """Write the traces for one archive file together, or append them if mode="ab"."""
+    with open(path, mode) as f:
+        Stream(traces).write(
+            f, format="MSEED", encoding=output_encoding, reclen=record_length
+        )
+
+
+def record_index(path):
+    """Map each trace id to the byte ranges of its records, reading headers only.
+
+    Returns None if a record is not a complete mSEED 2 record with blockette 1000.
+    """
+    index = {}  # Record byte ranges by trace id, in file order
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return index
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            offset = 0
+            while offset < size:
+                if offset + 48 > size or buf[offset + 6] not in b"DRQM":
+                    return None  # Truncated or not a data record
+
+                # Byte order from a plausible start year
+                (year,) = struct.unpack_from(">H", buf, offset + 20)
+                bo = ">" if 1900 <= year <= 2100 else "<"
+
+                # Record length from blockette 1000
+                reclen = None
+                visited = set()  # Blockette offsets, to stop on looping chains
+                (next_blockette,) = struct.unpack_from(f"{bo}H", buf, offset + 46)
+                while next_blockette and reclen is None:
+                    if next_blockette < 48 or next_blockette in visited:
+                        return None
+                    if offset + next_blockette + 8 > size:
+                        return None  # Blockette beyond the end of the file
+                    visited.add(next_blockette)
+                    b_type, b_next = struct.unpack_from(
+                        f"{bo}HH", buf, offset + next_blockette
+                    )
+                    if b_type == 1000:
+                        reclen = 2 ** min(buf[offset + next_blockette + 6], 31)
+                    next_blockette = b_next
+                if reclen is None or reclen < 128 or offset + reclen > size:
+                    return None  # No record length, or a truncated record
+
+                code = buf[offset + 8 : offset + 20].decode("ascii", "replace")
+                sta, loc, cha, net = code[:5], code[5:7], code[7:10], code[10:12]
+                trace_id = ".".join(c.strip() for c in (net, sta, loc, cha))
+                ranges = index.setdefault(trace_id, [])
+                if ranges and ranges[-1][1] == offset:
+                    ranges[-1][1] = offset + reclen  # Extend a contiguous range
+                else:
+                    ranges.append([offset, offset + reclen])
+                offset += reclen
+    return index
+
+
+def read_channel(path, index, trace_id):
+    """Read one trace id's records from a mSEED file."""
+    if index is None:
+        return read(path, sourcename=trace_id)  # Filtered scan of the whole file
+    with open(path, "rb") as f:
+        data = bytearray()
+        for start, end in index[trace_id]:
+            f.seek(start)
+            data += f.read(end - start)
+    return read(io.BytesIO(data), format="MSEED")
+
+
+def format_file(s):
+    """Format one mSEED file into the archive and return its logs and output files."""
+    messages = []  # Log levels and messages, replayed by the main process
+    headers = read(s, headonly=True)  # Trace headers only, no samples decoded
+    strm_file_path = Path(s)
+
+    # Ensure at least one trace is available
+    if len(headers) == 0:
+        messages.append(
+            (
+                logging.ERROR,
+                f"No traces found in {strm_file_path.name}, skipping file...",
+            )
+        )
+        return messages, []
+
+    messages.append(
+        (logging.INFO, f"Preparing {strm_file_path.name} with {len(headers)} traces...")
+    )
+
+    # Input mSEED directory identifier
+    label = strm_file_path.name.split(".")[0]
+
+    # Align trace headers to the chunk start time, validating every shift first
+    if fuse_alignment:
+        times = chunk_times(strm_file_path)
+        if times is None:
+            messages.append(
+                (
+                    logging.ERROR,
+                    f"No chunk times in {strm_file_path.name}, skipping file...",
+                )
+            )
+            return messages, []
+        align_stream(headers, times[0])
+        label = f"aligned_{label}"  # Match align.py output names
+
+    # Get stream temporal data information
+    stream_start = min(trc.stats.starttime for trc in headers)
+    stream_end = max(trc.stats.endtime for trc in headers)
+    first_day = UTCDateTime(stream_start.date)  # Start of the first UTC day
+
+    # Read, process, and write one station/channel at a time to bound memory
+    index = record_index(s)
+    trace_ids = list(dict.fromkeys(trc.id for trc in headers))  # In file order
+    aligned_file_path = a_mseed_path / f"aligned_{strm_file_path.name}"
+    aligned_part = aligned_file_path.with_name(f"{aligned_file_path.name}.part")
+    if fuse_alignment and write_aligned:
+        a_mseed_path.mkdir(parents=True, exist_ok=True)
+        aligned_file = open(aligned_part, "wb")
+
+    outputs = set()  # QuakeMigrate-formatted input mSEED files written
+    pending = {}  # Write futures by output file
+    with ThreadPoolExecutor(max_workers=max(write_workers, 1)) as executor:
+        for trace_id in trace_ids:
+            strm = read_channel(s, index, trace_id)
+
+            # Align traces to the chunk start time in a single pass
+            if fuse_alignment:
+                align_stream(strm, times[0])
+                if write_aligned:
+                    strm.write(aligned_file, format="MSEED")
+            if trace_id.split(".")[-1] not in channels:
+                continue  # Not a seismogram channel
+
+            for trc in strm:
+                # Resample trace data to the target sampling frequency
+                if target_fs is not None:
+                    resample_trace(trc)
+
+                # Zero-center trace data
+                trc.data = zero_center(trc.data)
+
+                # Log trace information if verbose
+                if verbose_logging:
+                    messages.append((logging.INFO, str(trc)))
+
+            # Split traces at UTC day boundaries, one input mSEED directory per day
+            writes = {}  # Traces to write by output file, in write order
+            day_start = first_day
+            while day_start <= stream_end:
+                day_end = day_start + 86400
+                year = str(day_start.year)  # Year
+                jul_day = day_start.strftime("%j")  # Julian day
+                # Start time HHMMSS format, from the first sample within the day
+                time_str = max(stream_start, day_start).strftime("%H%M%S")
+                dest_path = mseed_path / year / (jul_day + "_" + label)
+
+                # Group day traces by QuakeMigrate-formatted input mSEED file
+                for trce in strm:
+                    # Samples from midnight up to, but excluding, the next midnight
+                    day_trce = trce.slice(
+                        day_start, day_end - trce.stats.delta / 2, nearest_sample=False
+                    )
+                    if day_trce.stats.npts == 0:
+                        continue  # No samples within the day
+                    sta = trce.stats.station  # Station
+                    cha = trce.stats.channel  # Channel
+                    if archive_format == "YEAR/JD/*_STATION_*":
+                        filename = f"{year}{jul_day}_{time_str}_{sta}_{cha}.mseed"
+                    elif archive_format == "YEAR/JD/STATION":
+                        filename = f"{sta}_{cha}.mseed"
+                    else:
+                        raise ValueError("Invalid archive_format")
+                    writes.setdefault(dest_path / filename, []).append(day_trce)
+                day_start = day_end
+
+            # Write output files concurrently, as writes are I/O-bound
+            for path, traces in writes.items():
+                if path in pending:
+                    pending.pop(path).result()  # Keep writes to one file in order
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # Append to files already written for another location code
+                mode = "ab" if path.as_posix() in outputs else "wb"
+                pending[path] = executor.submit(write_traces, path, traces, mode)
+                outputs.add(path.as_posix())
+
+            # Hold at most a few channels of samples in pending writes
+            while len(pending) > 2 * max(write_workers, 1):
+                pending.pop(next(iter(pending))).result()  # Raise write exceptions
+
+        for future in pending.values():
+            future.result()  # Raise write exceptions
+
+    if verbose_logging:
+        messages.append(
+            (logging.INFO, "################################################\n")
+        )
+    if fuse_alignment and write_aligned:
+        aligned_file.close()
+        aligned_part.replace(aligned_file_path)
+    return messages, sorted(outputs)
+
+
 if __name__ == "__main__":
     # --- Ensure log directory exists ---
     log_path.mkdir(parents=True, exist_ok=True)
@@ -71,9 +417,16 @@ if __name__ == "__main__":
     file_handler.setFormatter(logger_format)
     logger.addHandler(file_handler)
 
+    # --- Check output encoding ---
+    if output_encoding not in ("FLOAT64", "FLOAT32", "STEIM2"):
+        output_encoding_error = "Invalid output_encoding"
+        logging.error(output_encoding_error)
+        raise ValueError(output_encoding_error)
+
     # --- Suppress UserWarning from zero-centering data type conversion ---
     # ObsPy automatically handles encoding when writing .mseed data
-    warnings.simplefilter("ignore", UserWarning)
+    if output_encoding == "FLOAT64":
+        warnings.simplefilter("ignore", UserWarning)
 
     logging.info("################################################")
     logging.info("Preparing mSEED files for QuakeMigrate input...")
@@ -82,78 +435,104 @@ if __name__ == "__main__":
     logging.info("mSEED preparation")
     logging.info("################################################")
 
-    # --- Sort aligned mSEED files chronologically ---
-    strms = sorted(a_mseed_path.glob(mseed_pattern))
-
-    # --- Loop through mSEED files ---
-    for s in strms:
-        strm = read(s)
-        strm_file_path = Path(s)
-
-        # Ensure at least one trace is available
-        if len(strm) == 0:
-            logging.error(f"No traces found in {strm_file_path.name}, skipping file...")
-            continue  # Skip to the next file
-
-        logging.info(f"Preparing {strm_file_path.name} with {len(strm)} traces...")
-
-        # Zero-center trace data
-        comps = [[trc for trc in strm.select(channel=ch)] for ch in channels]
-        for comp in comps:
-            for trc in comp:
-                trc.data = trc.data - np.mean(trc.data)
-
-                # Log trace information if verbose
-                if verbose_logging:
-                    logging.info(trc)
-        if verbose_logging:
-            logging.info("################################################\n")
-
-        # Get trace temporal data information
-        trc = strm[0]
-        year = str(trc.stats.starttime.year)  # Year
-        jul_starttime = trc.stats.starttime.strftime("%j")  # Start time julian day
-        jul_endtime = trc.stats.endtime.strftime("%j")  # End time julian day
-        time_str = trc.stats.starttime.strftime("%H%M%S")  # Start time HHMMSS format
-
-        # Input mSEED directory identifier
-        label = strm_file_path.name.split(".")[0]
-
-        dests = []
-        # mSEED data spans a single day
-        if jul_starttime == jul_endtime:
-            df = mseed_path / year / (jul_starttime + "_" + label)
-            dests.append(df)
-
-        # mSEED data spans multiple days
-        # Create input mSEED directories for start and end days
+    # --- Sort aligned (or raw if fusing alignment) mSEED files chronologically ---
+    input_path = r_mseed_path if fuse_alignment else a_mseed_path
+    strms = sorted(input_path.glob(mseed_pattern))
+
+    # --- Skip input mSEED files unchanged since the last run ---
+    settings = {
+        "archive_format": archive_format,
+        "channels": channels,
+        "fuse_alignment": fuse_alignment,
+        "output_encoding": output_encoding,
+        "record_length": record_length,
+        "target_fs": target_fs,
+    }
+    manifest = load_manifest(manifest_file)
+    previous = manifest.get("inputs", {})  # Outputs of the last run, by input
+    inputs = {}  # Inputs still valid under the current settings
+    if incremental and manifest.get("settings") == settings:
+        inputs = {
+            key: entry
+            for key, entry in previous.items()
+            if Path(key).exists()
+            and input_signature(Path(key)) == entry["signature"]
+            and all(Path(output).exists() for output in entry["outputs"])
+        }
+    elif incremental and previous:
+        logging.info("Format settings changed, reformatting all files")
+    pending = [s for s in strms if s.as_posix() not in inputs]
+    logging.info(
+        f"{len(pending)} of {len(strms)} files to format "
+        f"({len(strms) - len(pending)} unchanged)"
+    )
+
+    # --- Remove outputs of input files deleted from their directory ---
+    # Outputs are kept if no inputs are found (e.g. a wrong or unmounted directory),
+    # or if an input still exists but no longer matches mseed_pattern
+    if not strms and previous:
+        logging.warning(
+            f"No input files in {input_path}, keeping outputs of the last run"
+        )
+    keys = {s.as_posix() for s in strms}
+    for key, entry in previous.items():
+        path = Path(key)
+        if key in keys:
+            continue
+        if strms and path.parent.is_dir() and not path.exists():
+            logging.info(f"Removing outputs of {path.name}, no longer an input")
+            remove_outputs(entry["outputs"])
         else:
-            df_start = mseed_path / year / (jul_starttime + "_" + label)
-            df_end = mseed_path / year / (jul_endtime + "_" + label)
-            dests.extend([df_start, df_end])
-
-        # Create input mSEED directories
-        for dest in dests:
-            dest_path = Path(dest)
-            dest_path.mkdir(parents=True, exist_ok=True)
-
-            # Write QuakeMigrate-formatted input mSEED for each trace
-            for c in comps:
-                for trce in c:
-                    sta = trce.stats.station  # Station
-                    cha = trce.stats.channel  # Channel
-                    if archive_format == "YEAR/JD/*_STATION_*":
-                        filename = f"{year}{jul_starttime}_{time_str}_{sta}_{cha}.mseed"
-                    elif archive_format == "YEAR/JD/STATION":
-                        filename = f"{sta}_{cha}.mseed"
-                    else:
-                        archive_format_error = "Invalid archive_format"
-                        logging.error(archive_format_error)
-                        raise ValueError(archive_format_error)
-                    trce.write(dest / filename, format="MSEED")
+            # Keep tracking the outputs, reformatting the input if it has changed
+            inputs.setdefault(key, {"signature": None, "outputs": entry["outputs"]})
+    manifest = {"settings": settings, "inputs": inputs}
+    mseed_path.mkdir(parents=True, exist_ok=True)
+    save_manifest(manifest, manifest_file)
+
+    # --- Format mSEED files ---
+    # Files are formatted in worker processes and their logs replayed in file order
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+        try:
+            results = executor.map(format_file, pending)
+            for s, (messages, outputs) in zip(pending, results):
+                for level, message in messages:
+                    logging.log(level, message)
+
+                # Drop outputs of the last run no longer produced by this input
+                stale = set(previous.get(s.as_posix(), {}).get("outputs", []))
+                remove_outputs(sorted(stale - set(outputs)))
+                inputs[s.as_posix()] = {
+                    "signature": input_signature(s),
+                    "outputs": outputs,
+                }
+                save_manifest(manifest, manifest_file)
+        except ValueError as e:
+            logging.error(e)
+            executor.shutdown(cancel_futures=True)  # Stop pending files
+            raise
 
     logging.info("################################################\n")
 
+    # --- Record output sampling and encoding metadata ---
+    if target_fs is None:
+        resampling = None
+    elif (fs / target_fs).is_integer():
+        resampling = "zero-phase Butterworth low-pass (order 8, 0.4 * target_fs)"
+        resampling += f" and decimation by {int(fs / target_fs)}"
+    else:
+        resampling = "frequency-domain resampling (Hann window)"
+    metadata = {
+        "input_sampling_rate": fs,
+        "sampling_rate": fs if target_fs is None else target_fs,
+        "resampling": resampling,
+        "output_encoding": output_encoding,
+        "record_length": record_length,
+        "updated": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    mseed_path.mkdir(parents=True, exist_ok=True)
+    with open(metadata_file, "w") as f:
+        json.dump(metadata, f, indent=2)
+
     logging.info("################################################")
     logging.info("mSEED files prepared for QuakeMigrate input")
     logging.info("################################################")
@@ -0,0 +1,445 @@
+"""
+Script to serve a local FDSN dataselect and station stand-in for offline get.py runs
+
+Inputs:
+    - Synthetic station and waveform settings, or fixture mSEED and StationXML files
+
+Outputs:
+    - Local FDSN web service (dataselect, station, and availability) with latency
+      and failure injection
+"""
+
+# --- Import modules ---
+import fnmatch
+import io
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+from obspy import Stream, Trace, UTCDateTime, read, read_inventory
+from obspy.core.inventory import Channel, Inventory, Network, Station
+
+# ##############################################################################
+#                                Configurations                                #
+# ##############################################################################
+
+# Server address, point datacenter_url in get.py to http://host:port
+host = "127.0.0.1"
+port = 8080
+
+# Fixture files to serve (set to None to serve synthetic data)
+fixture_mseed = None  # e.g. Path("../bonus/sample.mseed")
+fixture_inventory = None  # e.g. Path("./benchmarks/inputs/response.xml")
+
+# Synthetic network, stations, channels, and sampling frequency (in Hz)
+network = "5B"
+stations = [f"{11111 + i}" for i in range(13)]
+channels = ["GPZ", "GP1", "GP2"]
+fs = 1000
+
+# Response latency (in seconds) added to every query, with uniform jitter
+latency = 0.2
+latency_jitter = 0.1
+
+# Fraction of queries answered with HTTP 503 (failure injection)
+failure_rate = 0.0
+
+# Queries served at once before answering HTTP 429 (throttling injection)
+# Set to None to serve any number of queries at once
+max_concurrent = None
+
+# Station outages without data, as station codes mapped to (starttime, endtime) pairs
+# e.g. {"11111": [(UTCDateTime("2020-01-01"), UTCDateTime("2020-01-02"))]}
+outages = {}
+
+# Longest dataselect window (in seconds) accepted before answering HTTP 413
+# Set to None to accept any window length
+max_window = None
+
+# Random seed for latency jitter and failure injection
+seed = 0
+
+# ##############################################################################
+#                            End of Configurations                             #
+# ##############################################################################
+
+# --- Dataselect and station parameters taken from WADL documents ---
+WADL_PARAMETERS = {
+    "dataselect": [
+        "starttime",
+        "endtime",
+        "network",
+        "station",
+        "location",
+        "channel",
+        "quality",
+        "minimumlength",
+        "longestonly",
+    ],
+    "station": [
+        "starttime",
+        "endtime",
+        "network",
+        "station",
+        "location",
+        "channel",
+        "minlatitude",
+        "maxlatitude",
+        "minlongitude",
+        "maxlongitude",
+        "level",
+        "format",
+    ],
+}
+
+
+def build_wadl(service, base_url):
+    """Build a minimal WADL document describing a service's query parameters."""
+    params = "\n".join(
+        f'        <param name="{name}" style="query" type="xs:string"/>'
+        for name in WADL_PARAMETERS[service]
+    )
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<application xmlns="http://wadl.dev.java.net/2009/02"
+             xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <resources base="{base_url}/fdsnws/{service}/1/">
+    <resource path="query">
+      <method name="GET" id="query">
+        <request>
+{params}
+        </request>
+      </method>
+    </resource>
+  </resources>
+</application>
+"""
+
+
+def matches(code, pattern):
+    """Match an FDSN code against a comma-separated wildcard pattern."""
+    if pattern in (None, "", "*"):
+        return True
+    code = code or "--"  # Empty location codes are written as "--"
+    return any(fnmatch.fnmatchcase(code, p) for p in pattern.split(","))
+
+
+def synthetic_trace(sta, cha, starttime, endtime, fs):
+    """Build a deterministic synthetic trace for a station channel and window."""
+    first = int(np.ceil(starttime.timestamp * fs))  # First sample index
+    last = int(np.floor(endtime.timestamp * fs))  # Last sample index
+    if last < first:
+        return None
+
+    # Pseudo-random counts that depend only on the absolute sample index,
+    # so adjacent windows join seamlessly
+    idx = np.arange(first, last + 1, dtype=np.uint64)
+    key = np.uint64(zlib.crc32(f"{sta}.{cha}".encode()))
+    mixed = (idx * np.uint64(2654435761) + key) % np.uint64(1 << 32)
+    data = ((mixed >> np.uint64(20)).astype(np.int32) % 2001) - 1000
+
+    header = {
+        "network": network,
+        "station": sta,
+        "location": "",
+        "channel": cha,
+        "sampling_rate": fs,
+        "starttime": UTCDateTime(first / fs),
+    }
+    return Trace(data=data.astype(np.int32), header=header)
+
+
+def available_windows(sta, starttime, endtime):
+    """Split a time window around a station's outages."""
+    windows = [(starttime, endtime)]
+    for out_start, out_end in outages.get(sta, []):
+        remaining = []
+        for t1, t2 in windows:
+            if out_end <= t1 or out_start >= t2:
+                remaining.append((t1, t2))
+                continue
+            if t1 < out_start:
+                remaining.append((t1, out_start))
+            if out_end < t2:
+                remaining.append((out_end, t2))
+        windows = remaining
+    return windows
+
+
+def select_waveforms(net, sta, loc, cha, starttime, endtime):
+    """Select fixture or synthetic waveforms for one dataselect request line."""
+    if not matches(network, net):
+        return Stream()
+
+    if fixture_stream is not None:
+        st = Stream(
+            [
+                tr
+                for tr in fixture_stream
+                if matches(tr.stats.station, sta)
+                and matches(tr.stats.location, loc)
+                and matches(tr.stats.channel, cha)
+            ]
+        )
+        return st.slice(starttime, endtime).copy()
+
+    st = Stream()
+    for s in stations:
+        for c in channels:
+            if matches(s, sta) and matches("", loc) and matches(c, cha):
+                for t1, t2 in available_windows(s, starttime, endtime):
+                    tr = synthetic_trace(s, c, t1, t2, fs)
+                    if tr is not None:
+                        st += tr
+    return st
+
+
+def select_availability(net, sta, loc, cha, starttime, endtime, merge=""):
+    """List available time spans as FDSN availability text rows.
+
+    Quality and SampleRate columns are omitted if merged, as per the FDSN spec.
+    """
+    merged = merge.lower().split(",")
+    columns = ["Network", "Station", "Location", "Channel"]
+    columns += [
+        name
+        for name, option in (("Quality", "quality"), ("SampleRate", "samplerate"))
+        if option not in merged
+    ]
+    columns += ["Earliest", "Latest"]
+    rows = ["#" + " ".join(columns)]
+    if fixture_stream is not None:
+        spans = [
+            (tr.stats.station, tr.stats.channel, tr.stats.starttime, tr.stats.endtime)
+            for tr in select_waveforms(net, sta, loc, cha, starttime, endtime)
+        ]
+    else:
+        spans = [
+            (s, c, t1, t2)
+            for s in stations
+            for c in channels
+            if matches(network, net)
+            and matches(s, sta)
+            and matches("", loc)
+            and matches(c, cha)
+            for t1, t2 in available_windows(s, starttime, endtime)
+        ]
+    for s, c, t1, t2 in spans:
+        values = {
+            "Network": network,
+            "Station": s,
+            "Location": "--",
+            "Channel": c,
+            "Quality": "D",
+            "SampleRate": f"{fs:.1f}",
+            "Earliest": t1.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "Latest": t2.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        }
+        rows.append(" ".join(values[name] for name in columns))
+    return rows
+
+
+def select_inventory(net, sta, loc, cha):
+    """Select fixture or synthetic station metadata."""
+    if fixture_inv is not None:
+        return fixture_inv.select(
+            network=net or "*",
+            station=sta or "*",
+            location=loc or "*",
+            channel=cha or "*",
+        )
+
+    start_date = UTCDateTime("2000-01-01T00:00:00.000000Z")
+    inv_stations = []
+    for i, s in enumerate(stations):
+        if not matches(s, sta):
+            continue
+        lat, lon, elev = -78.0 - 0.01 * i, -84.0, 321.0
+        inv_channels = [
+            Channel(
+                code=c,
+                location_code="",
+                latitude=lat,
+                longitude=lon,
+                elevation=elev,
+                depth=0.0,
+                sample_rate=fs,
+                start_date=start_date,
+            )
+            for c in channels
+            if matches(c, cha) and matches("", loc)
+        ]
+        inv_stations.append(
+            Station(
+                code=s,
+                latitude=lat,
+                longitude=lon,
+                elevation=elev,
+                channels=inv_channels,
+                start_date=start_date,
+            )
+        )
+    networks = [Network(code=network, stations=inv_stations)] if inv_stations else []
+    return Inventory(networks=networks, source="QuakeSupport FDSN stand-in")
+
+
+class FDSNHandler(BaseHTTPRequestHandler):
+    """Answer FDSN dataselect and station queries."""
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output quiet
+
+    def send_payload(self, code, payload=b"", content_type="text/plain"):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def inject(self):
+        """Apply throttling, latency, and failure injection, returning True if failing."""
+        global active_queries
+        with rng_lock:
+            delay = latency + rng.uniform(-latency_jitter, latency_jitter)
+            fail = rng.random() < failure_rate
+            throttle = max_concurrent is not None and active_queries >= max_concurrent
+            if not throttle:
+                active_queries += 1
+                self.counted = True
+        if throttle:
+            self.send_payload(429, b"Too many requests")
+            return True
+        time.sleep(max(delay, 0.0))
+        if fail:
+            self.send_payload(503, b"Injected failure")
+        return fail
+
+    def finish(self):
+        global active_queries
+        super().finish()
+        if getattr(self, "counted", False):
+            with rng_lock:
+                active_queries -= 1
+
+    def send_waveforms(self, lines):
+        """Answer dataselect request lines with one mSEED payload."""
+        st = Stream()
+        for net, sta, loc, cha, t1, t2 in lines:
+            starttime, endtime = UTCDateTime(t1), UTCDateTime(t2)
+            if max_window is not None and endtime - starttime > max_window:
+                self.send_payload(413, b"Request window too long")
+                return
+            st += select_waveforms(net, sta, loc, cha, starttime, endtime)
+
+        if len(st) == 0:
+            self.send_payload(204)
+            return
+        buf = io.BytesIO()
+        st.write(buf, format="MSEED")
+        self.send_payload(200, buf.getvalue(), "application/vnd.fdsn.mseed")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")  # fdsnws/<service>/1/<resource>
+        if len(parts) != 4 or parts[0] != "fdsnws":
+            self.send_payload(404)
+            return
+        service, resource = parts[1], parts[3]
+
+        if resource == "application.wadl" and service in WADL_PARAMETERS:
+            base_url = f"http://{self.headers['Host']}"
+            wadl = build_wadl(service, base_url).encode()
+            self.send_payload(200, wadl, "application/xml")
+        elif service == "dataselect" and resource in ("query", "queryauth"):
+            if self.inject():
+                return
+            line = (
+                query.get("network", query.get("net", "*")),
+                query.get("station", query.get("sta", "*")),
+                query.get("location", query.get("loc", "*")),
+                query.get("channel", query.get("cha", "*")),
+                query.get("starttime", query.get("start")),
+                query.get("endtime", query.get("end")),
+            )
+            self.send_waveforms([line])
+        elif service == "availability" and resource == "query":
+            if self.inject():
+                return
+            rows = select_availability(
+                query.get("network", query.get("net", "*")),
+                query.get("station", query.get("sta", "*")),
+                query.get("location", query.get("loc", "*")),
+                query.get("channel", query.get("cha", "*")),
+                UTCDateTime(query.get("starttime", query.get("start"))),
+                UTCDateTime(query.get("endtime", query.get("end"))),
+                query.get("merge", ""),
+            )
+            if len(rows) == 1:
+                self.send_payload(204)
+                return
+            self.send_payload(200, "\n".join(rows).encode() + b"\n")
+        elif service == "station" and resource == "query":
+            if self.inject():
+                return
+            inv = select_inventory(
+                query.get("network", query.get("net")),
+                query.get("station", query.get("sta")),
+                query.get("location", query.get("loc")),
+                query.get("channel", query.get("cha")),
+            )
+            if not inv.networks:
+                self.send_payload(204)
+                return
+            buf = io.BytesIO()
+            inv.write(buf, format="STATIONXML")
+            self.send_payload(200, buf.getvalue(), "application/xml")
+        else:
+            self.send_payload(404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") not in (
+            "/fdsnws/dataselect/1/query",
+            "/fdsnws/dataselect/1/queryauth",
+        ):
+            self.send_payload(404)
+            return
+        if self.inject():
+            return
+
+        # Bulk request lines: NET STA LOC CHA START END
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        lines = [
+            tuple(line.split())
+            for line in body.splitlines()
+            if line.strip() and "=" not in line
+        ]
+        self.send_waveforms(lines)
+
+
+def make_server(host, port):
+    """Create the stand-in server, bound but not yet serving."""
+    return ThreadingHTTPServer((host, port), FDSNHandler)
+
+
+# --- Shared state for handler threads ---
+rng = random.Random(seed)
+rng_lock = threading.Lock()
+active_queries = 0  # Queries past throttling and not yet answered
+fixture_stream = read(fixture_mseed) if fixture_mseed else None
+fixture_inv = read_inventory(fixture_inventory) if fixture_inventory else None
+
+if __name__ == "__main__":
+    server = make_server(host, port)
+    print("################################################")
+    print(f"FDSN stand-in serving at http://{host}:{server.server_address[1]}")
+    print("################################################")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
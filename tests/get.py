@@ -13,18 +13,37 @@ Outputs:
 """
 
 # --- Import modules ---
+import csv
 import datetime
+import fnmatch
+import hashlib
+import io
 import json
 import logging
+import os
+import random
+import statistics
 import sys
+import threading
 import time
 import traceback
+import urllib.parse
 import warnings
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from obspy import UTCDateTime
+from obspy import Stream, UTCDateTime, read, read_inventory
 from obspy.clients.fdsn import Client
-from obspy.core import Stream
+from obspy.clients.filesystem.sds import Client as SDSClient
+from obspy.clients.fdsn.header import (
+    FDSNBadGatewayException,
+    FDSNInternalServerException,
+    FDSNNoDataException,
+    FDSNRequestTooLargeException,
+    FDSNServiceUnavailableException,
+    FDSNTimeoutException,
+    FDSNTooManyRequestsException,
+)
 
 # ##############################################################################
 #                                Configurations                                #
@@ -37,6 +56,9 @@ credentials_file = Path("./credentials.json")  # Download credentials file
 r_mseed_path = Path("./inputs/raw_mSEED")  # Raw mSEED directory
 log_path = Path("./inputs/logs")  # Log directory
 response_file = Path("./inputs/response.xml")  # Instrument response inventory
+manifest_file = Path("./inputs/raw_mSEED/manifest.json")  # Download manifest
+segment_path = Path("./inputs/raw_mSEED/segments")  # Contiguous download segments
+cache_path = Path("./inputs/cache")  # FDSN query cache directory
 
 # Downloaded data formats
 seismic_format = "MSEED"  # Seismic data format
@@ -46,6 +68,20 @@ response_format = "STATIONXML"  # Instrument response inventory format
 network = "5B"
 datacenter = "IRISPH5"
 
+# Optional FDSN web service base URL (e.g. a local stand-in server)
+# Leave as None to resolve the data center name; datacenter still labels output files
+datacenter_url = None
+
+# Waveform source backend:
+# "fdsn": FDSN web service of the data center above
+# "sds": Local SeisComP Data Structure (SDS) archive under sds_root
+waveform_source = "fdsn"
+sds_root = Path("./SDS")  # SDS archive root directory, ignore if using FDSN
+
+# Optional local instrument response inventory (StationXML) to use instead of
+# querying the FDSN station service, e.g. for offline SDS archives
+local_inventory = None
+
 # Station information
 # Choose one option and uncomment the corresponding block:
 
@@ -111,50 +147,942 @@ times = [
 ]
 
 # Concurrent workers for multithreading
-workers = 6  # Recommended limit
+workers = 6  # Recommended limit, starting request concurrency if adaptive
+
+# Concurrent station requests per time chunk (1 = one station after another)
+# Served by one station pool shared across time chunks
+station_workers = 1
+
+# Number of stations per request when fanning out within a time chunk
+station_group_size = 1
+
+# Maximum waveform requests in flight to the data center across all time chunks
+# Kept at the recommended workers limit; raise only if the data center allows it
+max_requests = 6
+
+# Adaptive concurrency flag (AIMD control of in-flight requests if True)
+# Concurrency starts at workers, grows by one while requests are healthy, and halves
+# on HTTP 429/503, timeouts, or slow requests, bounded by min_requests and max_requests
+# Slow requests take slowdown_factor times the median latency of recent healthy
+# requests, at under 1/slowdown_factor of their median transfer rate (MB/s)
+adaptive_concurrency = True
+min_requests = 1
+slowdown_factor = 4
+
+# Client pool flag (gives each worker thread its own authenticated FDSN client if True)
+# Avoids serializing requests on one shared client; max_requests still caps the host
+client_per_thread = True
+
+# Bulk request flag (fetches each time chunk with one FDSN bulk request if True)
+# Falls back to per-station requests if the bulk request fails
+bulk_requests = False
 
-# Retries and wait time (backoff, in seconds) between retries if a download fails
+# Retries and base wait time (backoff, in seconds) between retries if a download fails
+# Only failed stations are retried; the wait doubles after each attempt, with jitter
 max_retries = 3  # Capped at 5 retries
-retry_backoff = 120  # 2 minutes (120 seconds), capped at 3 minutes (180 seconds)
+retry_backoff = 30  # 30 seconds, each wait capped at 3 minutes (180 seconds)
+
+# Adaptive bisection flag (splits requests the data center rejects into halves if True)
+# Only timeouts, HTTP 413 (request too large), and server errors (HTTP 5xx) are split
+# Halves are requested recursively down to min_request_size (in seconds), then merged
+bisect_requests = True
+min_request_size = 10 * 60  # 10 minutes (600 seconds)
+
+# Contiguous download flag (downloads overlapping time buffers only once if True)
+# The unbuffered timeline is downloaded in segments, then cut into buffered chunks
+contiguous_download = False
+
+# Metrics flag (writes per-request and per-chunk download metrics if True)
+# Metrics are written as JSON and CSV next to the run log, with a logged summary
+record_metrics = True
+
+# Availability pre-flight flag (checks data coverage before downloading if True)
+# Uses the FDSN availability service, or a header scan of the local SDS archive
+# All time chunks are downloaded if the availability service is missing or fails
+# Time chunks without data are skipped; only covered station/channels are requested
+check_availability = False
+
+# Query cache flag (reuses cached FDSN station and waveform responses if True)
+# Entries are keyed by the normalized query; least recently used entries are evicted
+# down to 90% of cache_size once it is exceeded
+use_cache = False
+cache_size = 20 * 1024**3  # Maximum cache size in bytes (20 GB)
+
+# Verification flag (check each chunk file before marking it complete if True)
+# Header-only checks of traces per requested trace id in the instrument response
+# inventory (missing traces, sample counts at fs, and gaps/overlaps)
+# Chunks failing verification are re-downloaded up to verify_retries times in all,
+# counted in the manifest across resumed runs (set resume_downloads = False to retry)
+verify_downloads = True
+verify_retries = 2
+fs = 1000  # Expected trace sampling frequency (in Hz)
+
+# Resume flag (skips time chunks recorded as complete in the manifest if True)
+# Chunk files are re-downloaded if missing or their size or checksum has changed
+# Checksums are only recomputed for files modified since they were recorded,
+# or for every file if verify_checksums is True (re-reads the whole dataset)
+resume_downloads = True
+verify_checksums = False
 
 # ##############################################################################
 #                            End of Configurations                             #
 # ##############################################################################
 
 
-def download_waveform_data(
-    network,
-    station,
-    location,
-    channel,
-    starttime,
-    endtime,
-    datacenter,
-    r_mseed_path,
+def chunk_filename(datacenter, network, starttime, endtime):
+    """Build the raw mSEED file name for a time chunk."""
+    start_str = starttime.strftime("%Y%m%d%H%M%S%f")
+    end_str = endtime.strftime("%Y%m%d%H%M%S%f")
+    combined_name = f"{datacenter}_{network}_{start_str}_{end_str}"
+    return f"{combined_name}.{seismic_format.lower()}"
+
+
+def file_checksum(path):
+    """Compute the SHA-256 checksum of a file."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def load_manifest(manifest_file):
+    """Load the download manifest, or start an empty one."""
+    if not manifest_file.exists():
+        return {}
+    try:
+        with open(manifest_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Unreadable manifest {manifest_file.name}, starting over: {e}")
+        return {}
+
+
+def save_manifest(manifest, manifest_file):
+    """Write the download manifest atomically."""
+    tmp_file = manifest_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    tmp_file.replace(manifest_file)
+
+
+def chunk_is_valid(path, statuses=("complete",)):
+    """Check a time chunk file against its manifest entry."""
+    entry = manifest.get(path.as_posix())
+    if not entry or entry.get("status") not in statuses or not path.exists():
+        return False
+    stat = path.stat()
+    if stat.st_size != entry.get("size"):
+        return False
+    if not verify_checksums and stat.st_mtime_ns == entry.get("mtime_ns"):
+        return True  # Unchanged since recorded, no need to re-read the file
+    if file_checksum(path) != entry.get("checksum"):
+        return False
+    with manifest_lock:
+        entry["mtime_ns"] = stat.st_mtime_ns  # Same contents, skip the next checksum
+        save_manifest(manifest, manifest_file)
+    return True
+
+
+def update_manifest(path, status, issues=None, attempts=None):
+    """Record the status of a time chunk file in the download manifest.
+
+    Incomplete chunks count their downloads, continuing from a previous entry
+    unless attempts is given.
+    """
+    entry = {
+        "status": status,
+        "updated": UTCDateTime().isoformat(),
+    }
+    if status in ("complete", "incomplete"):
+        entry["size"] = path.stat().st_size
+        entry["mtime_ns"] = path.stat().st_mtime_ns
+        entry["checksum"] = file_checksum(path)
+        entry["traces"] = len(read(path, headonly=True))
+    if issues:
+        entry["issues"] = issues  # Verification issues of incomplete chunks
+
+    with manifest_lock:
+        if status == "incomplete":
+            previous = manifest.get(path.as_posix(), {})
+            if attempts is None and previous.get("status") == "incomplete":
+                attempts = previous.get("attempts", 1) + 1
+            entry["attempts"] = attempts or 1
+        manifest[path.as_posix()] = entry
+        save_manifest(manifest, manifest_file)
+
+
+def verify_attempts_left(path):
+    """Check whether an incomplete time chunk may be downloaded again."""
+    return manifest.get(path.as_posix(), {}).get("attempts", 0) <= verify_retries
+
+
+def pending_time_pairs(time_pairs, mseed_dir):
+    """Select time pairs without a valid chunk file in the directory.
+
+    Incomplete chunk files are kept once their verification attempts run out.
+    """
+    if not resume_downloads:
+        return list(time_pairs)
+    pending = []
+    for start, end in time_pairs:
+        path = mseed_dir / chunk_filename(datacenter, network, start, end)
+        if chunk_is_valid(path):
+            continue
+        if not verify_attempts_left(path) and chunk_is_valid(path, ("incomplete",)):
+            continue
+        pending.append((start, end))
+    return pending
+
+
+def timeline_segments(time_pairs, time_buffer):
+    """Split buffered time chunks into non-overlapping timeline segments."""
+    # Merge overlapping buffered chunks into contiguous spans
+    spans = []
+    for start, end in sorted(time_pairs):
+        if spans and start <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([start, end])
+
+    # Split each span at the unbuffered chunk edges
+    cuts = sorted(
+        t for start, end in time_pairs for t in (start + time_buffer, end - time_buffer)
+    )
+    segments = []
+    for span_start, span_end in spans:
+        edges = [span_start]
+        for t in cuts:
+            if edges[-1] < t < span_end:
+                edges.append(t)
+        edges.append(span_end)
+        segments.extend(zip(edges[:-1], edges[1:]))
+    return segments
+
+
+def cut_chunk(segments, starttime, endtime, r_mseed_path):
+    """Cut a buffered time chunk file from downloaded timeline segments."""
+    output_filename = r_mseed_path / chunk_filename(
+        datacenter, network, starttime, endtime
+    )
+    strm = Stream()
+    status = "complete"
+    attempts = []  # Downloads of incomplete segments
+    for seg_start, seg_end in segments:
+        if seg_end <= starttime or seg_start >= endtime:
+            continue  # Segment outside of time chunk
+        seg_file = segment_path / chunk_filename(
+            datacenter, network, seg_start, seg_end
+        )
+        if manifest.get(seg_file.as_posix(), {}).get("status") == "empty":
+            continue  # Segment without data
+        if not chunk_is_valid(seg_file, ("complete", "incomplete")):
+            logging.error(f"Missing segment {seg_file.name} for {output_filename.name}")
+            update_manifest(output_filename, "failed")
+            return False
+        if manifest[seg_file.as_posix()]["status"] == "incomplete":
+            status = "incomplete"  # Re-download on resume while attempts are left
+            attempts.append(manifest[seg_file.as_posix()].get("attempts", 1))
+        strm += read(seg_file, starttime=starttime, endtime=endtime)
+
+    # Join traces across segment edges and trim to the buffered chunk
+    strm.merge(method=1)
+    strm = strm.split()  # Keep data gaps as separate traces
+    strm.trim(starttime, endtime)
+    strm.traces = [tr for tr in strm if tr.stats.npts > 0]
+    if len(strm) == 0:
+        logging.warning(f"No data for {output_filename.name}, skipping time chunk")
+        update_manifest(output_filename, "empty")
+        return True
+
+    part_filename = r_mseed_path / f"{output_filename.name}.part"
+    strm.write(part_filename, format=seismic_format)
+    part_filename.replace(output_filename)
+    update_manifest(output_filename, status, attempts=min(attempts, default=None))
+    logging.info(f"Cut {output_filename.name} from timeline segments")
+    return True
+
+
+def record_metric(
+    kind, station, starttime, endtime, seconds, nbytes, retries=0, status="ok"
 ):
-    """Download seismic data and save it as a .mseed file."""
-    master_stream = Stream()  # Set up master stream
-    logging.info(f"Downloading seismic data from {starttime} to {endtime}...")
+    """Record one download metric row."""
+    if not record_metrics:
+        return
+    row = {
+        "kind": kind,  # request, write, or chunk
+        "station": station,
+        "starttime": str(starttime),
+        "endtime": str(endtime),
+        "seconds": round(seconds, 6),
+        "bytes": nbytes,
+        "mb_per_s": round(nbytes / 1e6 / seconds, 6) if seconds > 0 else 0.0,
+        "retries": retries,
+        "status": status,
+    }
+    with metrics_lock:
+        metrics.append(row)
+
+
+def summarize_metrics(metrics, wall_seconds):
+    """Summarize download throughput, latency, and disk write rates."""
+    requests = [m for m in metrics if m["kind"] == "request"]
+    writes = [m for m in metrics if m["kind"] == "write"]
+    chunks = [m for m in metrics if m["kind"] == "chunk"]
+    latencies = sorted(m["seconds"] for m in requests)
+    request_bytes = sum(m["bytes"] for m in requests)
+    write_bytes = sum(m["bytes"] for m in writes)
+    write_seconds = sum(m["seconds"] for m in writes)
+
+    # Per-station totals to spot slow stations
+    stations = {}
+    for m in requests:
+        sta = stations.setdefault(m["station"], {"bytes": 0, "seconds": 0.0})
+        sta["bytes"] += m["bytes"]
+        sta["seconds"] += m["seconds"]
+    for sta in stations.values():
+        sta["seconds"] = round(sta["seconds"], 6)
+        sta["mb_per_s"] = (
+            round(sta["bytes"] / 1e6 / sta["seconds"], 6) if sta["seconds"] else 0.0
+        )
+
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "requests": len(requests),
+        "failed_requests": sum(m["status"] not in ("ok", "cached") for m in requests),
+        "cached_requests": sum(m["status"] == "cached" for m in requests),
+        "chunks": len(chunks),
+        "failed_chunks": sum(m["status"] == "failed" for m in chunks),
+        "incomplete_chunks": sum(m["status"] == "incomplete" for m in chunks),
+        "retries": sum(m["retries"] for m in chunks),
+        "mb_received": round(request_bytes / 1e6, 3),
+        "effective_mb_per_s": (
+            round(request_bytes / 1e6 / wall_seconds, 3) if wall_seconds else 0.0
+        ),
+        "median_latency_s": (
+            round(statistics.median(latencies), 3) if latencies else 0.0
+        ),
+        "p95_latency_s": (
+            round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else 0.0
+        ),
+        "write_mb_per_s": (
+            round(write_bytes / 1e6 / write_seconds, 3) if write_seconds else 0.0
+        ),
+        "stations": stations,
+    }
+
+
+def write_metrics(metrics, summary, metrics_stem):
+    """Write download metrics to JSON and CSV files."""
+    with open(metrics_stem.with_suffix(".json"), "w") as f:
+        json.dump({"summary": summary, "metrics": metrics}, f, indent=2)
+
+    with open(metrics_stem.with_suffix(".csv"), "w", newline="") as f:
+        writer = csv.DictWriter(
+            f,
+            fieldnames=[
+                "kind",
+                "station",
+                "starttime",
+                "endtime",
+                "seconds",
+                "bytes",
+                "mb_per_s",
+                "retries",
+                "status",
+            ],
+        )
+        writer.writeheader()
+        writer.writerows(metrics)
+
+
+def query_availability(station, starttime, endtime):
+    """Query FDSN availability time spans for the requested stations and channels.
+
+    Returns None if the availability service is missing or fails.
+    """
+    params = {
+        "network": network,
+        "station": station,
+        "location": location_input,
+        "channel": channel_input,
+        "starttime": starttime.strftime("%Y-%m-%dT%H:%M:%S.%f"),
+        "endtime": endtime.strftime("%Y-%m-%dT%H:%M:%S.%f"),
+        "merge": "samplerate,quality",
+        "nodata": "204",  # Leaves HTTP 404 for a missing service
+        "format": "text",
+    }
+    url = (
+        f"{client.base_url}{client.url_subpath}/availability/1/query?"
+        f"{urllib.parse.urlencode(params)}"
+    )
+    try:
+        # Through the client's opener, authenticated for restricted data
+        text = client._download(url, return_string=True).decode()
+    except FDSNNoDataException:
+        return []  # No data
+    except Exception as e:
+        logging.warning(f"Availability service unavailable: {e}")
+        return None
+
+    # Text rows, columns named by the "#" header line (merged columns are omitted)
+    extents = []
+    columns = []
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if line.startswith("#"):
+            columns = line.lstrip("#").split()
+            continue
+        if len(fields) == len(columns) - 1 and "Location" in columns:
+            fields.insert(columns.index("Location"), "--")  # Empty location omitted
+        row = dict(zip(columns, fields))
+        extents.append(
+            (
+                row["Station"],
+                row["Channel"],
+                UTCDateTime(row["Earliest"]),
+                UTCDateTime(row["Latest"]),
+            )
+        )
+    return extents
+
+
+def extents_coverage(extents, starttime, endtime):
+    """Select station/channels whose availability spans overlap a time window."""
+    return sorted(
+        {(sta, cha) for sta, cha, t1, t2 in extents if t1 < endtime and t2 > starttime}
+    )
+
+
+def archive_coverage(inv, starttime, endtime):
+    """Scan SDS archive headers for station/channels with data in a time window."""
+    # Inventory channels matching the requested locations and channels
+    channels = []
+    for loc in location_input.split(","):
+        loc = "" if loc == "--" else loc  # Empty location code
+        for cha in channel_input.split(","):  # Inventory patterns do not accept lists
+            channels.extend(
+                (net.code, sta.code, c.location_code, c.code)
+                for net in inv.select(location=loc, channel=cha)
+                for sta in net
+                for c in sta
+            )
+
+    covered = set()
+    for net_code, sta_code, loc_code, cha_code in channels:
+        if (sta_code, cha_code) in covered:
+            continue  # Already covered by another channel epoch or location
+        percentage, _ = waveform_client.get_availability_percentage(
+            net_code, sta_code, loc_code, cha_code, starttime, endtime
+        )
+        if percentage > 0:
+            covered.add((sta_code, cha_code))
+    return sorted(covered)
+
+
+# Errors signalling that the data center is throttling or overloaded
+CONGESTION_ERRORS = (
+    FDSNTooManyRequestsException,
+    FDSNServiceUnavailableException,
+    FDSNTimeoutException,
+    TimeoutError,
+)
+
+
+class AdaptiveLimiter:
+    """Additive-increase, multiplicative-decrease limit on in-flight requests."""
+
+    def __init__(self, initial, minimum, maximum):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.in_flight = 0
+        self.healthy = 0  # Healthy requests since the last increase
+        self.cooldown = 0  # Requests to complete before the next decrease
+        self.latencies = deque(maxlen=50)  # Recent healthy request latencies
+        self.rates = deque(maxlen=50)  # Recent healthy request transfer rates
+        self.cond = threading.Condition()
+        self.local = threading.local()
+
+    def __enter__(self):
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            self.in_flight += 1
+        self.local.t0 = time.perf_counter()
+        self.local.nbytes = None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        latency = time.perf_counter() - self.local.t0
+        nbytes = self.local.nbytes
+        with self.cond:
+            if exc_type is not None:
+                congested = issubclass(exc_type, CONGESTION_ERRORS)
+            else:
+                congested = self.is_slow(latency, nbytes)
+                if not congested and nbytes:
+                    self.latencies.append(latency)
+                    self.rates.append(nbytes / max(latency, 1e-6))
+            self.in_flight -= 1
+            self.cooldown = max(self.cooldown - 1, 0)
+            if congested:
+                self.healthy = 0
+                if self.cooldown == 0 and self.limit > self.minimum:
+                    reason = exc_type.__name__ if exc_type else f"{latency:.1f} s"
+                    self.set_limit(max(self.limit // 2, self.minimum), reason)
+                    self.cooldown = self.in_flight  # Let in-flight requests drain
+            elif exc_type is None:
+                self.healthy += 1
+                if self.healthy >= self.limit and self.limit < self.maximum:
+                    self.healthy = 0
+                    self.set_limit(self.limit + 1, f"{latency:.1f} s")
+            self.cond.notify_all()
+        return False  # Propagate request exceptions
+
+    def observe(self, nbytes):
+        """Record the bytes received by the calling thread's request."""
+        self.local.nbytes = nbytes
+
+    def is_slow(self, latency, nbytes):
+        """Check a request against the latency and transfer rate of recent ones."""
+        if not nbytes or len(self.latencies) < 5:
+            return False  # Too few healthy requests to compare against
+        rate = nbytes / max(latency, 1e-6)
+        return (
+            latency > slowdown_factor * statistics.median(self.latencies)
+            and rate < statistics.median(self.rates) / slowdown_factor
+        )
+
+    def set_limit(self, limit, reason):
+        """Change the concurrency limit and log the change."""
+        logging.info(
+            f"Request concurrency {self.limit} -> {limit} (last request: {reason})"
+        )
+        self.limit = limit
+
+
+def station_codes(station, starttime, endtime):
+    """List the station codes matching the station input across a time span."""
+    if local_inventory is not None:
+        span_inv = read_inventory(local_inventory).select(
+            network=network, starttime=starttime, endtime=endtime
+        )
+    else:
+        cached_file = cache_entry(
+            "station",
+            network=network,
+            station=station,
+            starttime=starttime,
+            endtime=endtime,
+            level="station",
+        )
+        data = cache_get(cached_file)
+        if data is None:
+            buf = io.BytesIO()
+            try:
+                client.get_stations(
+                    network=network,
+                    station=station,
+                    starttime=starttime,
+                    endtime=endtime,
+                    level="station",
+                    filename=buf,
+                )
+            except FDSNNoDataException:
+                return []
+            data = buf.getvalue()
+            cache_put(cached_file, data)
+        span_inv = read_inventory(io.BytesIO(data))
+    return sorted(
+        {
+            sta.code
+            for net in span_inv
+            for sta in net
+            if any(fnmatch.fnmatchcase(sta.code, p) for p in station.split(","))
+        }
+    )
+
+
+def make_client():
+    """Create an FDSN client for the data center, authenticated if credentials exist."""
+    base_url = datacenter_url or datacenter
+    if username and password:
+        return Client(base_url, user=username, password=password, timeout=120)
+    return Client(base_url, timeout=120)
+
+
+def thread_client():
+    """Return the calling thread's FDSN waveform client, creating it on first use."""
+    if not client_per_thread:
+        return waveform_client
+    if not hasattr(client_pool, "client"):
+        client_pool.client = make_client()  # Service discovery is cached by ObsPy
+    return client_pool.client
+
+
+def cache_entry(kind, **query):
+    """Locate the cache file for a normalized FDSN query."""
+    source = datacenter_url or datacenter
+    normalized = {key: str(value) for key, value in query.items()}
+    normalized.update({"kind": kind, "source": source})
+    key = hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+    suffix = "xml" if kind == "station" else seismic_format.lower()
+    return cache_path / key[:2] / f"{key}.{suffix}"
+
+
+def cache_get(path):
+    """Read a cached response, marking it as recently used."""
+    if not use_cache or not path.exists():
+        return None
+    try:
+        os.utime(path)  # Refresh for least recently used eviction
+        return path.read_bytes()
+    except OSError:
+        return None  # Evicted by another thread
+
+
+def cache_put(path, data):
+    """Store a response in the cache and evict old entries beyond the size cap."""
+    global cache_bytes
+    if not use_cache:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    tmp_file.write_bytes(data)
+
+    with cache_lock:
+        try:
+            replaced = path.stat().st_size  # Refreshed entry
+        except OSError:
+            replaced = 0
+        tmp_file.replace(path)
+        cache_bytes += len(data) - replaced
+        if cache_bytes <= cache_size:
+            return
+
+        # Evict below the cap, so the next puts do not scan the cache again
+        target = 0.9 * cache_size
+        entries = sorted(
+            (f for f in cache_path.glob("*/*") if not f.name.endswith(".tmp")),
+            key=lambda f: f.stat().st_mtime,
+        )
+        for entry in entries:
+            if cache_bytes <= target:
+                break
+            try:
+                entry_bytes = entry.stat().st_size
+                entry.unlink()
+            except OSError:
+                continue  # Removed since the scan
+            cache_bytes -= entry_bytes
+
+
+def group_stations(station, group_size):
+    """Split station input into comma-separated station groups."""
     stations = station if isinstance(station, list) else [station]
+    group_size = max(group_size, 1)
+    return [
+        ",".join(stations[i : i + group_size])
+        for i in range(0, len(stations), group_size)
+    ]
 
-    # Download and concatenate seismic data
-    for sta in stations:
-        st = client.get_waveforms(
+
+def read_archive(network, station, location, channel, starttime, endtime):
+    """Read seismic data for one station group from the local SDS archive."""
+    st = Stream()
+    location = "" if location == "--" else location  # SDS empty location code
+    for sta in station.split(","):
+        for cha in channel.split(","):  # SDS patterns do not accept lists
+            st += waveform_client.get_waveforms(
+                network, sta, location, cha, starttime, endtime
+            )
+    if len(st) == 0:
+        raise FDSNNoDataException(
+            f"No data for station(s) {station} from {starttime} to {endtime} "
+            f"in {sds_root}"
+        )
+    return st
+
+
+def request_waveforms(network, station, location, channel, starttime, endtime):
+    """Request seismic data for one station group within the request cap."""
+    if waveform_source == "fdsn":
+        cached_file = cache_entry(
+            "dataselect",
             network=network,
-            station=sta,
+            station=station,
             location=location,
             channel=channel,
             starttime=starttime,
             endtime=endtime,
         )
-        master_stream += st
+        refresh = any(t1 <= starttime and endtime <= t2 for t1, t2 in refresh_windows)
+        data = None if refresh else cache_get(cached_file)
+        if data is not None:
+            record_metric(
+                "request", station, starttime, endtime, 0.0, 0, status="cached"
+            )
+            return read(io.BytesIO(data), format=seismic_format)
+
+    buf = io.BytesIO()  # Raw response, to measure bytes received
+    with request_slots:
+        t0 = time.perf_counter()
+        try:
+            if waveform_source == "sds":
+                st = read_archive(
+                    network, station, location, channel, starttime, endtime
+                )
+            else:
+                thread_client().get_waveforms(
+                    network=network,
+                    station=station,
+                    location=location,
+                    channel=channel,
+                    starttime=starttime,
+                    endtime=endtime,
+                    filename=buf,
+                )
+        except Exception as e:
+            seconds = time.perf_counter() - t0
+            record_metric(
+                "request",
+                station,
+                starttime,
+                endtime,
+                seconds,
+                0,
+                status=type(e).__name__,
+            )
+            raise
+        seconds = time.perf_counter() - t0
+        if waveform_source == "sds":
+            nbytes = sum(tr.data.nbytes for tr in st)  # Decoded bytes read
+        else:
+            nbytes = buf.getbuffer().nbytes
+        if adaptive_concurrency:
+            request_slots.observe(nbytes)  # Size request latency for the limiter
+
+    if waveform_source == "sds":
+        record_metric("request", station, starttime, endtime, seconds, nbytes)
+        return st
+
+    record_metric("request", station, starttime, endtime, seconds, nbytes)
+    cache_put(cached_file, buf.getvalue())
+    buf.seek(0)
+    return read(buf, format=seismic_format)
+
+
+# Errors a smaller request may avoid (timeouts, HTTP 413, and server errors)
+BISECT_ERRORS = (
+    FDSNRequestTooLargeException,
+    FDSNInternalServerException,
+    FDSNBadGatewayException,
+    FDSNServiceUnavailableException,
+    FDSNTimeoutException,
+    TimeoutError,
+)
+
+
+def fetch_station_group(network, station, location, channel, starttime, endtime):
+    """Download seismic data for one station group, bisecting failed windows."""
+    try:
+        return request_waveforms(
+            network, station, location, channel, starttime, endtime
+        )
+    except BISECT_ERRORS as e:
+        half = (endtime - starttime) / 2
+        if not bisect_requests or half < min_request_size:
+            raise
+        midtime = starttime + half
+        logging.warning(
+            f"Request for station(s) {station} from {starttime} to {endtime} "
+            f"failed, splitting at {midtime}: {e}"
+        )
+        error = e
+
+    # Request each half and merge them back into one stream
+    st = Stream()
+    for t1, t2 in ((starttime, midtime), (midtime, endtime)):
+        try:
+            st += fetch_station_group(network, station, location, channel, t1, t2)
+        except FDSNNoDataException:
+            continue  # No data in this half
+    if len(st) == 0:
+        raise error
+    st.merge(method=1)
+    return st.split()  # Keep data gaps as separate traces
+
+
+def fetch_bulk(
+    network,
+    groups,
+    location,
+    channel,
+    starttime,
+    endtime,
+    chunk_file,
+    write_lock,
+):
+    """Download all station groups in one bulk request straight to the chunk file."""
+    bulk = [
+        (network, sta, location, channel, starttime, endtime)
+        for group in groups
+        for sta in group.split(",")
+    ]
+    with request_slots, write_lock:
+        t0 = time.perf_counter()
+        offset = chunk_file.tell()
+        try:
+            thread_client().get_waveforms_bulk(bulk, filename=chunk_file)
+            chunk_file.flush()
+        except Exception as e:
+            seconds = time.perf_counter() - t0
+            record_metric(
+                "request",
+                "bulk",
+                starttime,
+                endtime,
+                seconds,
+                0,
+                status=type(e).__name__,
+            )
+            raise
+        seconds = time.perf_counter() - t0
+        nbytes = chunk_file.tell() - offset
+        if adaptive_concurrency:
+            request_slots.observe(nbytes)  # Size request latency for the limiter
+    record_metric("request", "bulk", starttime, endtime, seconds, nbytes)
 
-    # Write master stream to mSEED file
-    start_str = starttime.strftime("%Y%m%d%H%M%S%f")
-    end_str = endtime.strftime("%Y%m%d%H%M%S%f")
-    combined_name = f"{datacenter}_{network}_{start_str}_{end_str}"
-    output_filename = r_mseed_path / f"{combined_name}.{seismic_format.lower()}"
-    master_stream.write(output_filename, format=seismic_format)
+
+def expected_channels(station, channel, starttime, endtime):
+    """List trace ids the inventory expects within a time window."""
+    stations = station if isinstance(station, list) else station.split(",")
+    expected = set()
+    for sta in stations:
+        for loc in location_input.split(","):
+            loc = "" if loc == "--" else loc  # Empty location code
+            for cha in channel.split(","):
+                sub_inv = inv.select(
+                    network=network,
+                    station=sta,
+                    location=loc,
+                    channel=cha,
+                    starttime=starttime,
+                    endtime=endtime,
+                )
+                expected.update(
+                    f"{net.code}.{s.code}.{c.location_code}.{c.code}"
+                    for net in sub_inv
+                    for s in net
+                    for c in s
+                )
+    return sorted(expected)
+
+
+def verify_chunk(path, station, channel, starttime, endtime):
+    """Check chunk file headers for missing channels, short reads, and gaps."""
+    st = read(path, headonly=True)  # Headers only, no sample decoding
+    expected_npts = int(round((endtime - starttime) * fs))
+    issues = []
+    for trace_id in expected_channels(station, channel, starttime, endtime):
+        traces = Stream([tr for tr in st if tr.id == trace_id])
+        if len(traces) == 0:
+            issues.append(f"{trace_id}: missing")
+            continue
+
+        rates = sorted({tr.stats.sampling_rate for tr in traces})
+        if rates != [fs]:
+            issues.append(f"{trace_id}: sampling rate {rates} Hz, expected {fs} Hz")
+
+        # Samples within the time window, allowing an end-exclusive window
+        npts = 0
+        for tr in traces:
+            overlap = min(tr.stats.endtime, endtime) - max(
+                tr.stats.starttime, starttime
+            )
+            if overlap >= 0:
+                npts += int(round(overlap * fs)) + 1
+        if npts < expected_npts:
+            issues.append(f"{trace_id}: {npts} of {expected_npts} samples")
+
+        gaps = traces.get_gaps()
+        n_gaps = sum(gap[6] > 0 for gap in gaps)
+        n_overlaps = len(gaps) - n_gaps
+        if gaps:
+            issues.append(f"{trace_id}: {n_gaps} gaps, {n_overlaps} overlaps")
+    return issues
+
+
+def append_stream(stream, chunk_file, write_lock):
+    """Append a station stream's records to the open chunk file."""
+    if len(stream) == 0:
+        return
+    with write_lock:
+        t0 = time.perf_counter()
+        offset = chunk_file.tell()
+        stream.write(chunk_file, format=seismic_format)
+        chunk_file.flush()
+        seconds = time.perf_counter() - t0
+        nbytes = chunk_file.tell() - offset
+    station = ",".join(sorted({tr.stats.station for tr in stream}))
+    stt = min(tr.stats.starttime for tr in stream)
+    ent = max(tr.stats.endtime for tr in stream)
+    record_metric("write", station, stt, ent, seconds, nbytes)
+
+
+def download_waveform_data(
+    network,
+    groups,
+    location,
+    channel,
+    starttime,
+    endtime,
+    chunk_file,
+    write_lock,
+    station_executor,
+):
+    """Stream station groups to the chunk file and return failed groups.
+
+    Station groups without data are not failures, so are not returned.
+    """
+    failed = {}  # Failed station groups and their errors
+
+    def fetch(group):
+        try:
+            st = fetch_station_group(
+                network, group, location, channel, starttime, endtime
+            )
+        except FDSNNoDataException:
+            # Absent stations are final, left for verification to report
+            logging.warning(
+                f"No data for station(s) {group} from {starttime} to {endtime}"
+            )
+            return
+        except Exception as e:
+            failed[group] = (e, traceback.format_exc())
+            return
+        append_stream(st, chunk_file, write_lock)  # Release station data on write
+
+    # Download seismic data and append each station group to the chunk file
+    if station_executor is not None and len(groups) > 1:
+        # Fan out station group requests over the shared station pool
+        futures_list = [station_executor.submit(fetch, group) for group in groups]
+        for future in futures_list:
+            future.result()  # Raise write exceptions
+    else:
+        for group in groups:
+            fetch(group)
+
+    return failed
+
+
+def backoff_delay(attempt, retry_backoff):
+    """Capped exponential backoff with jitter for a retry attempt."""
+    delay = min(retry_backoff * 2 ** (attempt - 1), 180)  # Maximum of 180 seconds
+    return random.uniform(delay / 2, delay)  # Jitter to desynchronize workers
 
 
 def download_and_handle_exception(
@@ -168,41 +1096,142 @@ def download_and_handle_exception(
     r_mseed_path,
     max_retries,
     retry_backoff,
+    station_executor,
 ):
-    """Download seismic data and handle exceptions with retries."""
+    """Download seismic data, retry failed stations, and verify the chunk file.
+
+    Returns True if the chunk file failed verification and should be re-downloaded,
+    up to verify_retries times across runs.
+    """
     # Cap the retries and backoff time
     max_retries = min(max_retries, 5)  # Maximum of 5 retries
     retry_backoff = min(retry_backoff, 180)  # Maximum of 3 minutes (180 seconds)
 
     attempt = 0
+    name = chunk_filename(datacenter, network, starttime, endtime)
+    output_filename = r_mseed_path / name
+    part_filename = r_mseed_path / f"{name}.part"  # In-progress chunk file
+    write_lock = threading.Lock()
+    pending = group_stations(station, station_group_size)  # Station groups to fetch
+    logging.info(f"Downloading seismic data from {starttime} to {endtime}...")
+    t0 = time.perf_counter()
 
-    while attempt <= max_retries:
-        try:
-            download_waveform_data(
+    with open(part_filename, "wb") as chunk_file:
+        if bulk_requests:
+            try:
+                fetch_bulk(
+                    network,
+                    pending,
+                    location,
+                    channel,
+                    starttime,
+                    endtime,
+                    chunk_file,
+                    write_lock,
+                )
+                pending = []
+            except Exception as e:
+                logging.warning(
+                    f"Bulk request from {starttime} to {endtime} failed, "
+                    f"falling back to per-station requests: {e}"
+                )
+                chunk_file.seek(0)
+                chunk_file.truncate()  # Drop any partial bulk response
+
+        failed = {}
+        while pending:
+            failed = download_waveform_data(
                 network,
-                station,
+                pending,
                 location,
                 channel,
                 starttime,
                 endtime,
-                datacenter,
-                r_mseed_path,
+                chunk_file,
+                write_lock,
+                station_executor,
             )
-            break  # Break out of the loop if download is successful
-        except Exception as e:
+            pending = [group for group in pending if group in failed]
+            if not failed:
+                break  # Break out of the loop if all stations are downloaded
+
             attempt += 1
-            exception_traceback = traceback.format_exc()  # Capture the traceback
-            msg = (
-                f"Attempt {attempt}/{max_retries}: Error downloading seismic data "
-                f"from {starttime} to {endtime}:\n{e}\n{exception_traceback}"
-            )
-            logging.error(msg)
+            for group, (e, exception_traceback) in failed.items():
+                msg = (
+                    f"Attempt {attempt}/{max_retries}: Error downloading station(s) "
+                    f"{group} from {starttime} to {endtime}:\n{e}\n{exception_traceback}"
+                )
+                logging.error(msg)
 
             if attempt <= max_retries:
-                logging.info("Retrying download...")
-                time.sleep(retry_backoff)
+                delay = backoff_delay(attempt, retry_backoff)
+                logging.info(
+                    f"Retrying {len(pending)} station request(s) in {delay:.1f} s..."
+                )
+                time.sleep(delay)
             else:
                 logging.error("Retry attempts failed")
+                break
+
+    if failed:
+        part_filename.unlink()  # Discard incomplete chunk file
+        update_manifest(output_filename, "failed")
+        record_metric(
+            "chunk",
+            "",
+            starttime,
+            endtime,
+            time.perf_counter() - t0,
+            0,
+            retries=attempt,
+            status="failed",
+        )
+        return False
+
+    if part_filename.stat().st_size == 0:
+        logging.warning(f"No data from {starttime} to {endtime}, skipping")
+        part_filename.unlink()
+        update_manifest(output_filename, "empty")
+        record_metric(
+            "chunk",
+            "",
+            starttime,
+            endtime,
+            time.perf_counter() - t0,
+            0,
+            retries=attempt,
+            status="empty",
+        )
+        return False
+
+    # Verify the chunk file before marking it complete
+    issues = []
+    if verify_downloads:
+        issues = verify_chunk(part_filename, station, channel, starttime, endtime)
+        for issue in issues:
+            logging.warning(f"Verification of {name}: {issue}")
+
+    # Publish the chunk file once all stations are written
+    part_filename.replace(output_filename)
+    status = "incomplete" if issues else "complete"
+    update_manifest(output_filename, status, issues)
+    retry = bool(issues) and verify_attempts_left(output_filename)
+    if issues and not retry:
+        logging.warning(
+            f"{name} still failing verification after "
+            f"{verify_retries + 1} downloads, marked incomplete in the manifest"
+        )
+    record_metric(
+        "chunk",
+        "",
+        starttime,
+        endtime,
+        time.perf_counter() - t0,
+        output_filename.stat().st_size,
+        retries=attempt,
+        status="incomplete" if issues else "ok",
+    )
+    return retry
 
 
 if __name__ == "__main__":
@@ -214,9 +1243,10 @@ if __name__ == "__main__":
         lineno=107,
     )
 
-    # --- Create directories to store raw mSEED files and logs ---
+    # --- Create directories to store raw mSEED files, manifest, and logs ---
     r_mseed_path.mkdir(parents=True, exist_ok=True)
     log_path.mkdir(parents=True, exist_ok=True)
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
 
     # --- Set up root logger ---
     logger = logging.getLogger()
@@ -236,23 +1266,47 @@ if __name__ == "__main__":
     logger.addHandler(file_handler)
 
     # --- Load download credentials ---
-    try:
-        with open(credentials_file, "r") as f:
-            credentials = json.load(f)
-        username = credentials["username"]
-        password = credentials["password"]
-    except Exception as e:
-        logging.error(f"Error reading credentials: {e}")
-        raise
+    if waveform_source not in ("fdsn", "sds"):
+        waveform_source_error = "Invalid waveform_source value; must be fdsn or sds"
+        logging.error(waveform_source_error)
+        raise ValueError(waveform_source_error)
+    use_fdsn = waveform_source == "fdsn" or local_inventory is None
 
-    # --- Initializing client ---
-    if username and password:
-        client = Client(datacenter, user=username, password=password, timeout=120)
+    if use_fdsn:
+        try:
+            with open(credentials_file, "r") as f:
+                credentials = json.load(f)
+            username = credentials["username"]
+            password = credentials["password"]
+        except Exception as e:
+            logging.error(f"Error reading credentials: {e}")
+            raise
+
+    # --- Set up query cache ---
+    cache_lock = threading.Lock()
+    cache_bytes = 0
+    if use_cache:
+        cache_path.mkdir(parents=True, exist_ok=True)
+        cache_bytes = sum(f.stat().st_size for f in cache_path.glob("*/*"))
+        logging.info(f"Query cache at {cache_path} holds {cache_bytes / 1e6:.1f} MB")
+
+    # --- Initializing clients ---
+    client = make_client() if use_fdsn else None
+    client_pool = threading.local()  # Per-thread FDSN clients
+
+    if waveform_source == "sds":
+        waveform_client = SDSClient(str(sds_root))
+        if bulk_requests:
+            logging.warning("Bulk requests apply to FDSN sources only, ignoring")
+            bulk_requests = False
     else:
-        client = Client(datacenter, timeout=120)
+        waveform_client = client
 
     logging.info("################################################")
-    logging.info(f"Accessing data from network {network} from {datacenter}...")
+    if waveform_source == "sds":
+        logging.info(f"Accessing data from network {network} in {sds_root}...")
+    else:
+        logging.info(f"Accessing data from network {network} from {datacenter}...")
 
     # --- Write instrument response inventory ---
     if isinstance(station_input, str):  # String
@@ -262,18 +1316,66 @@ if __name__ == "__main__":
     else:
         raise ValueError("station_input must be a string or list!")
 
-    inv = client.get_stations(
-        network=network,
-        station=station,
-        starttime=starttime,
-        endtime=endtime,
-        level="response",
-    )
+    if local_inventory is not None:
+        inv = read_inventory(local_inventory).select(
+            network=network, starttime=starttime, endtime=endtime
+        )
+        for net in inv:
+            net.stations = [
+                sta
+                for sta in net
+                if any(fnmatch.fnmatchcase(sta.code, p) for p in station.split(","))
+            ]
+    else:
+        cached_file = cache_entry(
+            "station",
+            network=network,
+            station=station,
+            starttime=starttime,
+            endtime=endtime,
+            level="response",
+        )
+        data = cache_get(cached_file)
+        if data is None:
+            buf = io.BytesIO()
+            client.get_stations(
+                network=network,
+                station=station,
+                starttime=starttime,
+                endtime=endtime,
+                level="response",
+                filename=buf,
+            )
+            data = buf.getvalue()
+            cache_put(cached_file, data)
+        else:
+            logging.info("Using cached instrument response inventory")
+        inv = read_inventory(io.BytesIO(data))
     inv.write(response_file, format=response_format, validate=True)
 
     logging.info("Instrument response inventory written")
     logging.info("################################################\n")
 
+    # --- Cap in-flight waveform requests across all time chunks ---
+    if adaptive_concurrency:
+        request_slots = AdaptiveLimiter(workers, min_requests, max_requests)
+        chunk_workers = max(workers, max_requests)  # Limiter gates concurrency
+        logging.info(
+            f"Adaptive request concurrency from {request_slots.limit}, "
+            f"between {request_slots.minimum} and {request_slots.maximum}"
+        )
+    else:
+        request_slots = threading.BoundedSemaphore(max(max_requests, 1))
+        chunk_workers = workers
+
+    # --- Share one station request pool across time chunks ---
+    # Long-lived threads keep their per-thread FDSN clients from chunk to chunk
+    station_executor = None
+    if station_workers > 1:
+        station_executor = ThreadPoolExecutor(
+            max_workers=station_workers * chunk_workers
+        )
+
     # --- Generate pairs of start and end times ---
     if time_type == 1:  # Regular time chunks
         time_pairs = [
@@ -291,6 +1393,91 @@ if __name__ == "__main__":
         logging.error(time_type_error)
         raise ValueError(time_type_error)
 
+    # --- Expand wildcard station input for per-station fan-out ---
+    if station_workers > 1 and isinstance(station_input, str) and time_pairs:
+        station_input = station_codes(
+            station,
+            min(start for start, _ in time_pairs),
+            max(end for _, end in time_pairs),
+        )
+        logging.info(f"Fanning out requests over {len(station_input)} stations")
+
+    # --- Skip time chunks already downloaded ---
+    manifest = load_manifest(manifest_file) if resume_downloads else {}
+    manifest_lock = threading.Lock()
+    pending_pairs = pending_time_pairs(time_pairs, r_mseed_path)
+    skipped = len(time_pairs) - len(pending_pairs)
+    if skipped:
+        logging.info(f"Skipping {skipped} time chunks already downloaded")
+    time_pairs = pending_pairs
+
+    # --- Download the unbuffered timeline once if contiguous ---
+    if contiguous_download:
+        segment_path.mkdir(parents=True, exist_ok=True)
+        segments = timeline_segments(time_pairs, time_buffer)
+        download_pairs = pending_time_pairs(segments, segment_path)
+        download_path = segment_path
+        logging.info(
+            f"Downloading {len(download_pairs)} of {len(segments)} timeline segments "
+            f"for {len(time_pairs)} time chunks"
+        )
+    else:
+        download_pairs = time_pairs
+        download_path = r_mseed_path
+
+    # --- Check data availability before downloading ---
+    # Requests hold the time window, covered stations, and covered channels
+    download_requests = [
+        (start, end, station_input, channel_input) for start, end in download_pairs
+    ]
+    coverages = None  # Station/channels with data in each window, once checked
+    if check_availability and download_pairs:
+        logging.info("Checking data availability...")
+        if waveform_source == "sds":
+            coverages = [
+                archive_coverage(inv, start, end) for start, end in download_pairs
+            ]
+        else:
+            extents = query_availability(
+                station,
+                min(start for start, _ in download_pairs),
+                max(end for _, end in download_pairs),
+            )
+            if extents is None:
+                logging.warning("Downloading all windows without an availability check")
+            else:
+                coverages = [
+                    extents_coverage(extents, start, end)
+                    for start, end in download_pairs
+                ]
+
+    if coverages is not None:
+        download_requests = []
+        for (start, end), covered in zip(download_pairs, coverages):
+            stations = sorted({sta for sta, _ in covered})
+            channels = ",".join(sorted({cha for _, cha in covered}))
+            logging.info(
+                f"{start} to {end}: {len(stations)} stations, "
+                f"{len(covered)} station/channels with data"
+            )
+            if not covered:
+                logging.warning(f"No data from {start} to {end}, skipping")
+                update_manifest(
+                    download_path / chunk_filename(datacenter, network, start, end),
+                    "empty",
+                )
+                continue
+            download_requests.append((start, end, stations, channels))
+
+        skipped = len(download_pairs) - len(download_requests)
+        logging.info(f"Availability check skipped {skipped} windows without data")
+
+    # --- Collect download metrics across threads ---
+    metrics = []
+    metrics_lock = threading.Lock()
+    refresh_windows = []  # Re-downloaded time windows, bypassing the query cache
+    download_start = time.perf_counter()
+
     # --- Concurrently download seismic data ---
     logging.info("Data downloads")
     logging.info("################################################")
@@ -298,28 +1485,86 @@ if __name__ == "__main__":
     if not time_pairs:
         logging.warning("No seismic data to download")
     else:
-        with ThreadPoolExecutor(max_workers=workers) as executor:
-            futures_list = [
-                executor.submit(
-                    download_and_handle_exception,
-                    network,
-                    station_input,
-                    location_input,
-                    channel_input,
-                    start,
-                    end,
-                    datacenter,
-                    r_mseed_path,
-                    max_retries,
-                    retry_backoff,
+        with ThreadPoolExecutor(max_workers=chunk_workers) as executor:
+            while download_requests:
+                futures = {
+                    executor.submit(
+                        download_and_handle_exception,
+                        network,
+                        stations,
+                        location_input,
+                        channels,
+                        start,
+                        end,
+                        datacenter,
+                        download_path,
+                        max_retries,
+                        retry_backoff,
+                        station_executor,
+                    ): (start, end, stations, channels)
+                    for start, end, stations, channels in download_requests
+                }
+                # Queue chunks failing verification for re-download
+                download_requests = [
+                    futures[future]
+                    for future in as_completed(futures)
+                    if future.result()  # Raise thread exceptions
+                ]
+                if download_requests:
+                    logging.info(
+                        f"Re-downloading {len(download_requests)} time chunks "
+                        "failing verification..."
+                    )
+                    refresh_windows.extend(
+                        (start, end) for start, end, _, _ in download_requests
+                    )
+
+            # Cut buffered time chunks from the downloaded segments
+            if contiguous_download:
+                futures_list = [
+                    executor.submit(cut_chunk, segments, start, end, r_mseed_path)
+                    for start, end in time_pairs
+                ]
+                cut_results = [future.result() for future in futures_list]
+
+        # Remove segments once every time chunk has been cut
+        if contiguous_download and all(cut_results):
+            for seg_start, seg_end in segments:
+                seg_file = segment_path / chunk_filename(
+                    datacenter, network, seg_start, seg_end
                 )
-                for start, end in time_pairs
-            ]
-            for future in as_completed(futures_list):
-                future.result()  # Raise thread exceptions
+                seg_file.unlink(missing_ok=True)
+
+    if station_executor is not None:
+        station_executor.shutdown()
 
     logging.info("################################################\n")
 
+    # --- Write download metrics and log summary ---
+    if record_metrics and metrics:
+        summary = summarize_metrics(metrics, time.perf_counter() - download_start)
+        write_metrics(metrics, summary, log_path / f"get_{current_time}_metrics")
+
+        logging.info("Download metrics")
+        logging.info("################################################")
+        logging.info(
+            f"{summary['requests']} requests ({summary['failed_requests']} failed, "
+            f"{summary['cached_requests']} cached), "
+            f"{summary['chunks']} chunks ({summary['failed_chunks']} failed, "
+            f"{summary['incomplete_chunks']} incomplete), "
+            f"{summary['retries']} retries"
+        )
+        logging.info(
+            f"{summary['mb_received']} MB received in {summary['wall_seconds']} s "
+            f"({summary['effective_mb_per_s']} MB/s effective)"
+        )
+        logging.info(
+            f"Request latency: median {summary['median_latency_s']} s, "
+            f"95th percentile {summary['p95_latency_s']} s"
+        )
+        logging.info(f"Disk write rate: {summary['write_mb_per_s']} MB/s")
+        logging.info("################################################\n")
+
     logging.info("################################################")
     logging.info("Seismic data downloads complete")
     logging.info("################################################")
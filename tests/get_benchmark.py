@@ -0,0 +1,162 @@
+"""
+Script to benchmark get.py downloads against the local FDSN stand-in server
+
+Inputs:
+    - get.py download script
+    - fdsn_server.py stand-in server
+
+Outputs:
+    - Benchmark results table (wall time, throughput, and latency per run)
+"""
+
+# --- Import modules ---
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+import fdsn_server
+
+# ##############################################################################
+#                                Configurations                                #
+# ##############################################################################
+
+# Input paths
+get_script = Path("./get.py")  # Download script to benchmark
+
+# Output paths
+results_file = Path("./get_benchmark.csv")  # Benchmark results table
+
+# Worker counts (time chunks in parallel) and station counts to sweep
+worker_counts = [1, 2, 4, 8]
+station_counts = [4, 16, 64]
+
+# Concurrent station requests within each time chunk
+station_workers = 1
+
+# Time chunks per run and size (in seconds) of each time chunk
+time_chunks = 8
+chunk_size = 60  # 1 minute (60 seconds)
+
+# Stand-in server sampling frequency (in Hz), latency (in seconds), and failures
+fs = 1000
+latency = 0.2
+failure_rate = 0.0
+max_concurrent = None  # Queries served at once before throttling (HTTP 429)
+
+# ##############################################################################
+#                            End of Configurations                             #
+# ##############################################################################
+
+END_OF_CONFIG = "#                            End of Configurations"
+
+
+def configure_script(content, overrides):
+    """Append configuration overrides to the end of a script's configuration block."""
+    lines = content.splitlines(keepends=True)
+    marker = next(i for i, line in enumerate(lines) if END_OF_CONFIG in line)
+    override_lines = [f"{name} = {value}\n" for name, value in overrides.items()]
+    # Insert above the "# ####" rule preceding the end marker
+    return "".join(lines[: marker - 1] + override_lines + ["\n"] + lines[marker - 1 :])
+
+
+def run_benchmark(base_url, stations, workers):
+    """Run get.py once in a scratch directory and return its download summary."""
+    run_dir = Path(tempfile.mkdtemp(prefix="get_benchmark_"))
+    try:
+        overrides = {
+            "datacenter_url": repr(base_url),
+            "datacenter": repr("LOCAL"),
+            "network": repr(fdsn_server.network),
+            "station_input": repr(stations),
+            "location_input": repr("--"),
+            "channel_input": repr("GP*"),
+            "time_type": 1,
+            "starttime": 'UTCDateTime("2020-01-01T00:00:00.000000Z")',
+            "endtime": f'UTCDateTime("2020-01-01T00:00:00.000000Z") + {chunk_size}',
+            "time_chunks": time_chunks,
+            "chunk_size": chunk_size,
+            "workers": workers,
+            "station_workers": station_workers,
+            "max_requests": workers * station_workers,  # Cap above the sweep
+            "adaptive_concurrency": False,  # Fixed concurrency per run
+            "resume_downloads": False,
+            "record_metrics": True,
+        }
+        script = run_dir / "get.py"
+        script.write_text(configure_script(get_script.read_text(), overrides))
+        (run_dir / "credentials.json").write_text(
+            json.dumps({"username": "", "password": ""})
+        )
+
+        t0 = time.perf_counter()
+        subprocess.run(
+            [sys.executable, script.name],
+            cwd=run_dir,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        wall_seconds = time.perf_counter() - t0
+
+        metrics_files = sorted((run_dir / "inputs" / "logs").glob("get_*_metrics.json"))
+        summary = json.loads(metrics_files[-1].read_text())["summary"]
+        summary["run_seconds"] = round(wall_seconds, 3)
+        return summary
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # --- Configure and start the stand-in server ---
+    fdsn_server.fs = fs
+    fdsn_server.latency = latency
+    fdsn_server.failure_rate = failure_rate
+    fdsn_server.max_concurrent = max_concurrent
+    server = fdsn_server.make_server("127.0.0.1", 0)  # Any free port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    get_script = get_script.resolve()
+
+    print("################################################")
+    print(f"Benchmarking {get_script.name} against {base_url}...")
+    print("################################################\n")
+
+    # --- Sweep station and worker counts ---
+    columns = [
+        "stations",
+        "workers",
+        "run_seconds",
+        "requests",
+        "failed_requests",
+        "mb_received",
+        "effective_mb_per_s",
+        "median_latency_s",
+        "p95_latency_s",
+        "write_mb_per_s",
+    ]
+    rows = []
+    print(" | ".join(f"{c:>18}" for c in columns))
+    try:
+        for n_stations in station_counts:
+            fdsn_server.stations = [f"{11111 + i}" for i in range(n_stations)]
+            for workers in worker_counts:
+                summary = run_benchmark(base_url, fdsn_server.stations, workers)
+                row = {**summary, "stations": n_stations, "workers": workers}
+                rows.append(row)
+                print(" | ".join(f"{row[c]:>18}" for c in columns))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # --- Write benchmark results table ---
+    with open(results_file, "w") as f:
+        f.write(",".join(columns) + "\n")
+        for row in rows:
+            f.write(",".join(str(row[c]) for c in columns) + "\n")
+
+    print("\n################################################")
+    print(f"Benchmark results written to {results_file}")
+    print("################################################")